@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from flask import g
+
+from wsw import app, cache, configure_pool, migrations
+
+
+@contextmanager
+def temporary_database():
+    # Fresh, fully migrated schema in a throw-away directory, g.db is ready
+    # to use
+    directory = tempfile.mkdtemp()
+    database = app.config['DATABASE']
+    app.config['DATABASE'] = os.path.join(directory, 'bench.db')
+    configure_pool()
+    cache.invalidate_all()
+    try:
+        with app.test_request_context():
+            app.preprocess_request()
+            g.read_only = False
+            migrations.reset(g.db)
+            yield g.db
+    finally:
+        app.config['DATABASE'] = database
+        configure_pool()
+        shutil.rmtree(directory)
+
+
+@contextmanager
+def timer(result):
+    start = time.time()
+    yield
+    result.append(time.time() - start)
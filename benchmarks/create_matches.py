@@ -0,0 +1,45 @@
+"""Time Season.create_all_matches for growing divisions.
+
+    python -m benchmarks.create_matches
+"""
+import sys
+from datetime import datetime
+
+from wsw.league import Season
+from benchmarks import temporary_database, timer
+
+
+MAPS = 5
+
+
+def populate(db, players):
+    db.execute('DELETE FROM matches')
+    db.execute('DELETE FROM signups')
+    db.execute('DELETE FROM users')
+    db.executemany("""
+        INSERT INTO users(id, username, email, password) VALUES(?, ?, ?, ?)
+        """, ((i, 'player%i' % i, '%i@bench' % i, '') for i in
+            range(1, players + 1)))
+    db.executemany("""
+        INSERT INTO signups(season_id, user_id, division) VALUES(1, ?, 1)
+        """, ((i,) for i in range(1, players + 1)))
+    db.commit()
+
+
+def main(sizes=(16, 64, 256)):
+    with temporary_database() as db:
+        db.execute('INSERT INTO seasons DEFAULT VALUES')
+        season = Season(1)
+        print '%8s %8s %10s %10s' % ('players', 'matches', 'rows', 'seconds')
+        for players in sizes:
+            populate(db, players)
+            elapsed = []
+            with timer(elapsed):
+                assert season.create_all_matches([1], MAPS, datetime.now(), 'w')
+            matches = db.execute('SELECT COUNT(*) FROM matches').fetchone()[0]
+            rows = matches * (1 + 2 + MAPS)
+            print '%8i %8i %10i %10.3f' % (players, matches, rows, elapsed[0])
+
+
+if __name__ == '__main__':
+    main(tuple(int(arg) for arg in sys.argv[1:]) or (16, 64, 256))
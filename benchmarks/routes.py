@@ -0,0 +1,219 @@
+"""Time the hot routes against generated leagues.
+
+    python -m benchmarks.routes [--output run.json] [--baseline base.json]
+
+Prints (or writes) per-route latency percentiles and SQL statement counts
+as JSON, counted by the SQL tracer so timings include its overhead. With --baseline the run fails when a route got slower than the
+tolerance allows or runs more statements than before.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+
+import wsw
+from wsw import app
+from wsw.league import Season
+from benchmarks import temporary_database, timer
+
+
+# (name, seasons, users, divisions, players per division)
+SCENARIOS = [
+        ('small', 1, 100, 1, 10),
+        ('medium', 10, 1000, 10, 16),
+        ('large', 100, 10000, 50, 16),
+        ]
+
+PASSWORD = 'bench'
+MAPS = 3
+
+
+def generate(db, seasons, users, divisions, size):
+    pw_hash = wsw.hasher.generate(PASSWORD)
+    db.executemany('INSERT INTO seasons(id) VALUES(?)',
+            ((i,) for i in range(1, seasons + 1)))
+    db.execute("""
+        INSERT INTO users(id, username, email, password, is_admin)
+        VALUES(1, 'admin', 'admin@bench', ?, 1)
+        """, (pw_hash,))
+    db.executemany("""
+        INSERT INTO users(id, username, email, password) VALUES(?, ?, ?, ?)
+        """, ((i, 'player%i' % i, '%i@bench' % i, pw_hash)
+            for i in range(2, users + 1)))
+
+    # everybody signs up every season, the first divisions * size players
+    # get a division, the rest wait
+    def signups(season_id):
+        for user_id in range(2, users + 1):
+            division = (user_id - 2) / size + 1
+            yield (season_id, user_id,
+                    division if division <= divisions else None)
+    for season_id in range(1, seasons + 1):
+        db.executemany("""
+            INSERT INTO signups(season_id, user_id, division) VALUES(?, ?, ?)
+            """, signups(season_id))
+
+    maps = [('wdm%i' % i, 'Map %i' % i) for i in range(1, MAPS + 1)]
+    db.executemany('INSERT INTO maps(id, name) VALUES(?, ?)', maps)
+    db.executemany('INSERT INTO season_maps(season_id, map_id) VALUES(?, ?)',
+            ((seasons, map_id) for map_id, name in maps))
+    db.commit()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = int(round(p / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def measure(client, method, url, data, requests):
+    getattr(client, method)(url, data=data)  # warm up
+    durations = []
+    statements = []
+    for i in range(requests):
+        start = time.time()
+        response = getattr(client, method)(url, data=data)
+        durations.append(time.time() - start)
+        statements.append(int(response.headers['X-SQL-Count']))
+        if response.status_code >= 400:
+            raise RuntimeError("%s %s: %i" % (method.upper(), url,
+                response.status_code))
+    return {
+            'requests': requests,
+            'p50_ms': percentile(durations, 50) * 1000,
+            'p90_ms': percentile(durations, 90) * 1000,
+            'p99_ms': percentile(durations, 99) * 1000,
+            'mean_ms': sum(durations) / len(durations) * 1000,
+            'queries': max(statements),
+            }
+
+
+def run_scenario(name, seasons, users, divisions, size, requests):
+    result = {
+            'seasons': seasons,
+            'users': users,
+            'divisions': divisions,
+            'division_size': size,
+            'routes': {},
+            }
+    with temporary_database() as db:
+        generate(db, seasons, users, divisions, size)
+
+        season = Season(seasons)
+        elapsed = []
+        with timer(elapsed):
+            season.create_all_matches(range(1, divisions + 1), MAPS,
+                    datetime(2013, 1, 1, 20), 'w')
+        matches = db.execute('SELECT COUNT(*) FROM matches').fetchone()[0]
+        result['create_matches'] = {'seconds': elapsed[0], 'matches': matches}
+
+        login = {'login_username': 'player2', 'login_password': PASSWORD}
+        admin_login = {'login_username': 'admin', 'login_password': PASSWORD}
+
+        anonymous = app.test_client()
+        player = app.test_client()
+        player.post('/login', data=login)
+        admin = app.test_client()
+        admin.post('/login', data=admin_login)
+
+        routes = [
+                ('/', anonymous, 'get', '/', None),
+                ('/ (player)', player, 'get', '/', None),
+                ('/signups/', anonymous, 'get', '/signups/', None),
+                ('/users/', anonymous, 'get', '/users/', None),
+                ('/admin/signups/<id>', admin, 'get',
+                    '/admin/signups/%i' % seasons, None),
+                ('/admin/matches/<id>', admin, 'get',
+                    '/admin/matches/%i' % seasons, None),
+                ('/login', app.test_client(), 'post', '/login', login),
+                ]
+        for label, client, method, url, data in routes:
+            result['routes'][label] = measure(client, method, url, data,
+                    requests)
+
+    return result
+
+
+def slower(now, before, tolerance, slack):
+    # sub-millisecond routes jitter by more than any sane tolerance
+    return now > before * (1 + tolerance) and now - before > slack
+
+
+def compare(run, baseline, tolerance, slack=1.0):
+    regressions = []
+    for name, scenario in run['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if not base:
+            continue
+        for route, stats in scenario['routes'].items():
+            before = base['routes'].get(route)
+            if not before:
+                continue
+            if slower(stats['p90_ms'], before['p90_ms'], tolerance, slack):
+                regressions.append("%s %s: p90 %.1fms, baseline %.1fms" % (
+                    name, route, stats['p90_ms'], before['p90_ms']))
+            if stats['queries'] > before['queries']:
+                regressions.append("%s %s: %i queries, baseline %i" % (
+                    name, route, stats['queries'], before['queries']))
+        seconds = scenario['create_matches']['seconds']
+        before = base['create_matches']['seconds']
+        if slower(seconds, before, tolerance, slack / 1000):
+            regressions.append("%s create_matches: %.3fs, baseline %.3fs" % (
+                name, seconds, before))
+    return regressions
+
+
+def parse_scenario(value):
+    seasons, users, divisions, size = (int(i) for i in value.split(','))
+    return ('custom-' + value, seasons, users, divisions, size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Route benchmarks")
+    parser.add_argument('--scenario', action='append', type=parse_scenario,
+            help="seasons,users,divisions,division_size")
+    parser.add_argument('--only', action='append',
+            help="run only the named built-in scenarios")
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+            help="allowed slowdown against the baseline, 0.25 is 25%%")
+    parser.add_argument('--slack', type=float, default=1.0,
+            help="ignore slowdowns below this many milliseconds")
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenario or [s for s in SCENARIOS
+            if not args.only or s[0] in args.only]
+
+    # trace statements, skip CSRF for the login posts and keep bcrypt cheap
+    app.config['SQL_TRACE'] = True
+    app.config['CSRF_ENABLED'] = False
+    wsw.hasher.rounds = 4
+
+    run = {'created': datetime.utcnow().isoformat(), 'scenarios': {}}
+    for name, seasons, users, divisions, size in scenarios:
+        run['scenarios'][name] = run_scenario(name, seasons, users,
+                divisions, size, args.requests)
+
+    output = json.dumps(run, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(run, json.load(f), args.tolerance,
+                    args.slack)
+        for regression in regressions:
+            print >> sys.stderr, regression
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Compare query_db's old per-row dicts with the cached record classes.
+
+    python -m benchmarks.rows
+"""
+import sqlite3
+import sys
+
+from wsw.rows import make_records, iter_records
+from benchmarks import timer
+
+
+QUERY = 'SELECT id, username, division, points, wins, draws, losses FROM t'
+
+
+def dicts(cur):
+    # query_db before records
+    return [dict((cur.description[idx][0], value)
+        for idx, value in enumerate(row)) for row in cur.fetchall()]
+
+
+def records(cur):
+    return make_records(cur, cur.fetchall())
+
+
+def stream(cur):
+    for record in iter_records(cur):
+        pass
+
+
+def main(sizes=(10000, 100000), repeat=3):
+    db = sqlite3.connect(':memory:')
+    print '%8s %12s %12s %12s' % ('rows', 'dicts', 'records', 'streamed')
+    for size in sizes:
+        db.execute('DROP TABLE IF EXISTS t')
+        db.execute("""CREATE TABLE t (id integer, username text,
+            division integer, points integer, wins integer, draws integer,
+            losses integer)""")
+        db.executemany('INSERT INTO t VALUES(?, ?, ?, ?, ?, ?, ?)',
+                ((i, 'player%i' % i, i % 20, i % 30, i % 7, i % 3, i % 5)
+                    for i in range(size)))
+        best = []
+        for build in (dicts, records, stream):
+            elapsed = []
+            for i in range(repeat):
+                with timer(elapsed):
+                    build(db.execute(QUERY))
+            best.append(min(elapsed))
+        print '%8i %11.3fs %11.3fs %11.3fs' % ((size,) + tuple(best))
+
+
+if __name__ == '__main__':
+    main(tuple(int(arg) for arg in sys.argv[1:]) or (10000, 100000))
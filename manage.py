@@ -0,0 +1,212 @@
+import argparse
+import os
+import sys
+import time
+
+from wsw import app
+
+
+def migrate(args):
+    from flask import g
+    from wsw import migrations
+    for number, description in migrations.migrate(g.db, args.target):
+        print "Applied %i: %s" % (number, description)
+    print "Database at version %i" % migrations.get_version(g.db)
+
+
+def check_plans(args):
+    from wsw import queryplans
+    scans = queryplans.find_full_scans(queryplans.create_database())
+    for name, detail in scans:
+        print "%s: %s" % (name, detail)
+    if scans:
+        return 1
+    print "No full table scans in %i queries" % len(queryplans.HOT_QUERIES)
+
+
+def rebuild_standings(args):
+    from wsw import standings
+    standings.rebuild(args.season)
+    print "Rebuilt standings for season %i" % args.season
+
+
+def rebuild_ratings(args):
+    from wsw import ratings
+    start = time.time()
+    count = ratings.rebuild()
+    print "Replayed %i matches in %.2fs (%s)" % (count, time.time() - start,
+            'numpy' if ratings.numpy is not None else 'pure Python')
+
+
+def build_assets(args):
+    from wsw import assets
+    report = assets.build(app.static_folder,
+            app.config['LEVELSHOT_THUMBNAIL_SIZE'])
+    totals = dict.fromkeys(('original', 'gzip', 'brotli'), 0)
+    for logical, sizes in sorted(report.items()):
+        for key in totals:
+            totals[key] += sizes.get(key, sizes['original'])
+    print "Built %i assets into %s" % (len(report),
+            os.path.join(app.static_folder, assets.BUILD))
+    print "%i bytes, %i gzipped, %i brotli" % (totals['original'],
+            totals['gzip'], totals['brotli'])
+
+
+def ingest_stats(args):
+    from wsw import ingest
+    report = ingest.ingest(args.paths, args.season, args.workers, args.batch)
+    for error in report.errors:
+        print >>sys.stderr, error
+    print report
+    return 1 if report.errors else 0
+
+
+def import_users(args):
+    from wsw import bulk, hasher
+    if args.workers is not None:
+        hasher.configure(args.workers, hasher.rounds, hasher.queue_limit,
+                hasher.timeout)
+    try:
+        format = bulk.get_format(args.file, args.format)
+    except ValueError as e:
+        print >>sys.stderr, e
+        return 2
+    with (sys.stdin if args.file == '-' else open(args.file, 'rb')) as f:
+        report = bulk.import_users(f, format, args.season,
+                not args.no_signup, args.batch)
+    for line, message in report.errors:
+        print >>sys.stderr, "line %i: %s" % (line, message)
+    print report
+    return 1 if report.errors else 0
+
+
+def export_data(args):
+    from wsw import bulk
+    try:
+        exports = bulk.get_exports(args.only.split(',') if args.only
+                else None)
+    except ValueError as e:
+        print >>sys.stderr, e
+        return 2
+    if not os.path.isdir(args.directory):
+        os.makedirs(args.directory)
+    for name, fields, query in exports:
+        path = os.path.join(args.directory, '%s.%s' % (name, args.format))
+        start = time.time()
+        with open(path, 'wb') as f:
+            count = bulk.export(name, f, args.format)
+        print "%s: %i rows in %.2fs" % (path, count, time.time() - start)
+
+
+def archive_season(args):
+    from wsw import archive
+    from wsw.league import Season
+    if not Season(args.season).exists():
+        print >>sys.stderr, "No season %i" % args.season
+        return 2
+    output = args.output or archive.filename(args.season, args.format)
+    start = time.time()
+    size = 0
+    with (sys.stdout if output == '-' else open(output, 'wb')) as f:
+        for chunk in archive.stream(args.season, args.format):
+            f.write(chunk)
+            size += len(chunk)
+    if output != '-':
+        print "Wrote %s, %i bytes in %.2fs" % (output, size,
+                time.time() - start)
+
+
+def run_jobs(args):
+    from wsw import runner
+    runner.start(args.workers)
+    print "Running jobs with %i workers, Ctrl-C to stop" % args.workers
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        runner.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warsow League management")
+    commands = parser.add_subparsers()
+
+    command = commands.add_parser('migrate',
+            help="apply pending schema migrations to the database")
+    command.add_argument('--target', type=int, default=None)
+    command.set_defaults(func=migrate)
+
+    command = commands.add_parser('check-plans',
+            help="fail if a hot query falls back to a full table scan")
+    command.set_defaults(func=check_plans)
+
+    command = commands.add_parser('rebuild-standings',
+            help="recompute a season's standings from its results")
+    command.add_argument('season', type=int)
+    command.set_defaults(func=rebuild_standings)
+
+    command = commands.add_parser('rebuild-ratings',
+            help="replay every completed match to recompute the ratings")
+    command.set_defaults(func=rebuild_ratings)
+
+    command = commands.add_parser('build-assets',
+            help="fingerprint, compress and thumbnail the static files")
+    command.set_defaults(func=build_assets)
+
+    command = commands.add_parser('ingest',
+            help="load game results from server stats files or directories")
+    command.add_argument('paths', nargs='+')
+    command.add_argument('--season', type=int, default=None,
+            help="defaults to the current season")
+    command.add_argument('--workers', type=int, default=None)
+    command.add_argument('--batch', type=int, default=None,
+            help="games per transaction")
+    command.set_defaults(func=ingest_stats)
+
+    command = commands.add_parser('import-users',
+            help="create users from a CSV, JSON Lines or JSON file")
+    command.add_argument('file', help="'-' reads standard input")
+    command.add_argument('--format', choices=('csv', 'jsonl', 'json'),
+            help="defaults to the file's extension")
+    command.add_argument('--season', type=int, default=None,
+            help="season to sign the users up for, defaults to the current")
+    command.add_argument('--no-signup', action='store_true')
+    command.add_argument('--batch', type=int, default=500,
+            help="users per transaction")
+    command.add_argument('--workers', type=int, default=None,
+            help="hashing processes, defaults to HASH_WORKERS")
+    command.set_defaults(func=import_users)
+
+    command = commands.add_parser('export',
+            help="write users, signups and match history to a directory")
+    command.add_argument('directory')
+    command.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    command.add_argument('--only', help="e.g. users,signups")
+    command.set_defaults(func=export_data)
+
+    command = commands.add_parser('archive',
+            help="write a season's gzipped archive")
+    command.add_argument('season', type=int)
+    command.add_argument('--format', choices=('jsonl', 'csv'),
+            default='jsonl')
+    command.add_argument('--output', help="defaults to "
+            "season-<id>.<format>.gz, '-' writes to standard output")
+    command.set_defaults(func=archive_season)
+
+    command = commands.add_parser('run-jobs',
+            help="run queued background jobs until interrupted")
+    command.add_argument('--workers', type=int, default=1)
+    command.set_defaults(func=run_jobs)
+
+    args = parser.parse_args(argv)
+    from flask import g
+    with app.test_request_context():
+        app.preprocess_request()
+        # the test context resolves to a @read_only view, commands must
+        # read what they write
+        g.read_only = False
+        return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
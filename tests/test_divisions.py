@@ -0,0 +1,36 @@
+import unittest
+
+import wsw
+from wsw import app, tracing
+from wsw.league import Season
+from benchmarks import temporary_database
+from benchmarks.routes import generate
+
+
+class DivisionQueriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trace_setting = app.config['SQL_TRACE']
+        app.config['SQL_TRACE'] = True
+        wsw.hasher.rounds = 4
+
+    def tearDown(self):
+        app.config['SQL_TRACE'] = self.trace_setting
+
+    def count_queries(self, divisions):
+        # statements run loading `divisions` divisions of 4 players
+        with temporary_database() as db:
+            generate(db, 1, divisions * 4 + 5, divisions, 4)
+            trace = tracing.begin(db)
+            loaded = Season(1).get_divisions()
+            self.assertEqual(len(loaded), divisions)
+            self.assertEqual(len(wsw.get_divisions(1, form=True)), divisions)
+            tracing.end(db)
+            return len(trace.statements)
+
+    def test_query_count_is_constant(self):
+        self.assertEqual(self.count_queries(1), self.count_queries(25))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+
+from wsw import archive, queryplans
+
+
+class QueryPlanTest(unittest.TestCase):
+
+    def test_no_full_table_scans(self):
+        scans = queryplans.find_full_scans(queryplans.create_database())
+        self.assertEqual(scans, [], '\n'.join('%s: %s' % scan
+            for scan in scans))
+
+    def test_archive_results_in_index_order(self):
+        db = queryplans.create_database()
+        query = dict((name, query) for name, fields, query
+                in archive.SECTIONS)['results']
+        plan = [row[-1] for row in
+                db.execute('EXPLAIN QUERY PLAN ' + query, (1,))]
+        self.assertFalse([detail for detail in plan if 'TEMP B-TREE' in detail],
+                plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
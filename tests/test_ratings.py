@@ -0,0 +1,53 @@
+import unittest
+
+from wsw import ratings
+
+
+# (season_id, round, alpha, beta, score), player 1 plays twice in round 1
+MATCHES = [
+        (1, 1, 1, 2, 1.0),
+        (1, 1, 1, 3, 0.0),
+        (1, 1, 4, 5, 0.5),
+        (2, None, 2, 3, 1.0),
+        (2, None, 3, 1, 1.0),
+        ]
+
+
+def replay_one_by_one(matches, initial, k):
+    current = {}
+    deltas = []
+    for season_id, round, alpha, beta, value in matches:
+        rating = current.get(alpha, initial)
+        other = current.get(beta, initial)
+        delta = k * (value - ratings.expected(rating, other))
+        current[alpha] = rating + delta
+        current[beta] = other - delta
+        deltas.append(delta)
+    return deltas, current
+
+
+class ReplayTest(unittest.TestCase):
+
+    def check(self, replay):
+        deltas, result, seasons = replay(MATCHES, 1500.0, 32)
+        expected_deltas, expected = replay_one_by_one(MATCHES, 1500.0, 32)
+        for delta, expected_delta in zip(deltas, expected_deltas):
+            self.assertAlmostEqual(delta, expected_delta)
+        for user_id, rating in expected.items():
+            self.assertAlmostEqual(result[user_id][0], rating)
+        self.assertEqual(result[1][1], 3)
+        # player 1's season 1 rating is the one after their last match there
+        self.assertAlmostEqual(seasons[(1, 1)][0],
+                1500.0 + expected_deltas[0] + expected_deltas[1])
+        self.assertEqual(seasons[(1, 1)][1], 2)
+
+    def test_python(self):
+        self.check(ratings.replay_python)
+
+    @unittest.skipIf(ratings.numpy is None, "numpy is not installed")
+    def test_numpy(self):
+        self.check(ratings.replay_numpy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+import wsw
+from wsw import app
+from benchmarks import temporary_database
+from benchmarks.routes import PASSWORD, generate
+
+
+class DeactivateUserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.csrf_setting = app.config.get('CSRF_ENABLED', True)
+        app.config['CSRF_ENABLED'] = False
+        wsw.hasher.rounds = 4
+
+    def tearDown(self):
+        app.config['CSRF_ENABLED'] = self.csrf_setting
+
+    def login(self, username):
+        client = app.test_client()
+        response = client.post('/login', data={'login_username': username,
+            'login_password': PASSWORD})
+        self.assertEqual(response.status_code, 302)
+        return client
+
+    def test_deactivated_admin_loses_access(self):
+        with temporary_database() as db:
+            generate(db, 1, 3, 0, 2)
+            db.execute('UPDATE users SET is_admin = 1 WHERE id = 2')
+            db.commit()
+            admin = self.login('admin')
+            other = self.login('player2')
+            # cached by now
+            self.assertEqual(other.get('/admin/').status_code, 200)
+            self.assertEqual(other.get('/admin/').status_code, 200)
+
+            response = admin.post('/admin/deactivate_user/2')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(other.get('/admin/').status_code, 302)
+            self.assertEqual(admin.get('/admin/').status_code, 200)
+
+    def test_demotion_elsewhere_applies_to_admin_routes(self):
+        with temporary_database() as db:
+            generate(db, 1, 3, 0, 2)
+            db.execute('UPDATE users SET is_admin = 1 WHERE id = 2')
+            db.commit()
+            other = self.login('player2')
+            self.assertEqual(other.get('/admin/').status_code, 200)
+
+            # as another process would, without touching this cache
+            db.execute('UPDATE users SET is_admin = 0 WHERE id = 2')
+            db.commit()
+            self.assertEqual(other.get('/admin/').status_code, 302)
+
+
+if __name__ == '__main__':
+    unittest.main()
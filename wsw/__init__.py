@@ -1,68 +1,117 @@
 import sqlite3
+import time
 
 from flask import Flask, g, request, url_for
 
-from flask.ext.bcrypt import Bcrypt
 from flask.ext.login import LoginManager, current_user
 
 from wsw.forms import LoginForm
 from wsw.users import User, Anonymous
 from wsw.admin import RemoveDivisionForm
 from wsw.league import Season
+from wsw.pool import ConnectionPool, get_pragmas
+from wsw.rows import make_records, iter_records
+from wsw.hashing import Hasher
+from wsw.api import api
+from wsw.snapshot import Snapshot
+from wsw.jobs import JobRunner
+from wsw import assets, cache, migrations, pages, tracing
 import admin
 
 
 # Application
 
 app = Flask(__name__)
-bcrypt = Bcrypt(app)
 app.config.from_object('wsw.config')
 app.register_blueprint(admin.admin, url_prefix='/admin')
+app.register_blueprint(assets.assets, url_prefix='/assets')
+app.register_blueprint(api, url_prefix='/api/v1')
+app.jinja_env.globals.update(asset_url=assets.asset_url,
+        levelshot=assets.levelshot, user_fragment=pages.user_fragment)
+
+hasher = Hasher(app.config['HASH_WORKERS'], app.config['BCRYPT_LOG_ROUNDS'],
+        app.config['HASH_QUEUE_LIMIT'], app.config['HASH_TIMEOUT'])
+
+cache.reference.configure(app.config['REFERENCE_CACHE_SIZE'],
+        app.config['REFERENCE_CACHE_TTL'])
+cache.users.configure(app.config['USER_CACHE_SIZE'],
+        app.config['USER_CACHE_TTL'])
+cache.navigation.configure(app.config['NAVIGATION_CACHE_SIZE'],
+        app.config['NAVIGATION_CACHE_TTL'])
+cache.pages.configure(app.config['PAGE_CACHE_BYTES'],
+        app.config['PAGE_CACHE_TTL'])
+
+tracing.recorder.repeat = app.config['SQL_TRACE_REPEAT']
+
+
+def get_factory():
+    # plain connections unless tracing, so it costs nothing when off
+    if app.config['SQL_TRACE']:
+        return tracing.TracingConnection
+    return sqlite3.Connection
+
+pool = ConnectionPool(app.config['DATABASE'],
+        size=app.config['DATABASE_POOL_SIZE'],
+        timeout=app.config['DATABASE_POOL_TIMEOUT'],
+        pragmas=get_pragmas(app.config), factory=get_factory())
+
+snapshot = Snapshot(app.config['DATABASE'], app.config['SNAPSHOT'],
+        app.config['SNAPSHOT_REFRESH_INTERVAL'],
+        app.config['SNAPSHOT_CHECK_INTERVAL'])
+
+runner = JobRunner(app)
 
 
 # Callbacks
 
+@app.before_first_request
+def start_jobs():
+    runner.start()
+
+
 @app.before_request
 def before_request():
-    g.db = connect_db()
-    query = 'PRAGMA foreign_keys = ON'
-    g.db.execute(query)
+    g.db = pool.acquire()
+    g.db_changes = g.db.total_changes
+    view = app.view_functions.get(request.endpoint)
+    g.read_only = getattr(view, 'read_only', False)
+    g.sql_trace = tracing.begin(g.db)
+
+
+MATCH_COUNTS_QUERY = """
+SELECT user_id, COUNT(*) FROM match_players
+JOIN matches ON matches.id = match_id
+WHERE season_id = ?
+GROUP BY user_id
+"""
+
+
+def get_match_counts(season_id):
+    cur = g.db.execute(MATCH_COUNTS_QUERY, (season_id,))
+    return dict(cur.fetchall())
 
 
 def match_link():
     if current_user.is_authenticated():
         season_id = Season.get_current_season_id()
-        query = """
-        SELECT COUNT(*) as count FROM matches
-        LEFT JOIN match_players ON match_id = matches.id
-        WHERE season_id = ?
-        AND user_id = ?
-        """
-        result = query_db(query, (season_id, current_user.get_id()), True)
-        if result['count']:
-            return ('matches/my', 'matches', "Matches (%i)" % result['count'])
+        counts = cache.navigation.get(('matches', season_id),
+                lambda: get_match_counts(season_id))
+        count = counts.get(int(current_user.get_id()), 0)
+        if count:
+            return ('matches/my', 'matches', "Matches (%i)" % count)
 
     return ('/matches', 'matches', "Matches")
 
 def season_link():
-    query = """
-    SELECT id FROM seasons
-    ORDER BY id DESC
-    """
-    cur = g.db.execute(query)
-    seasons = (x[0] for x in cur.fetchall())
-    links = []
-    for season_id in seasons:
-        links = links + [(url_for('season', id=season_id), 'season', 'Season %i'%season_id)]
     return ('/', 'season', "Season %i" % Season.get_current_season_id())
 
-@app.context_processor
-def inject_navigation():
+def get_navigation():
     menu = [
             ('/', 'index', 'Home'),
             season_link(),
             ('/users', 'users', 'Users'),
             ('/signups', 'signups', 'Sign-ups'),
+            ('/standings', 'standings', 'Standings'),
             match_link(),
             ('/reset', 'reset', 'Reset'),
             ]
@@ -75,26 +124,57 @@ def inject_navigation():
                 ('/login', 'login', 'Login'),
                 ('/register', 'register', 'Register')
                 ]
+    return menu
+
+@app.context_processor
+def inject_navigation():
+    # built at most once per request
+    menu = getattr(g, 'navigation_bar', None)
+    if menu is None:
+        menu = g.navigation_bar = get_navigation()
     return dict(navigation_bar=menu)
 
 
+@app.after_request
+def report_sql(response):
+    trace = getattr(g, 'sql_trace', None)
+    if trace is not None:
+        summary = tracing.recorder.record(request.endpoint, trace)
+        tracing.add_headers(response, summary)
+    return response
+
+
 @app.teardown_request
 def teardown_request(exception):
     if hasattr(g, 'db'):
-        g.db.close()
+        if g.db.total_changes != getattr(g, 'db_changes', None):
+            data_changed()
+        tracing.end(g.db)
+        pool.release(g.db)
+        del g.db
 
 
 # Login manager
 
+LOAD_USER_QUERY = """
+SELECT username, is_active, is_admin FROM users WHERE id = ?
+"""
+
 login_manager = LoginManager()
 
 @login_manager.user_loader
 def load_user(id):
-    query = 'SELECT username, is_active, is_admin FROM users WHERE id = ?'
-    result = query_db(query, [id], True)
-    if result:
-        return User(result['username'], id, result['is_admin'], result['is_active'])
-    return Anonymous()
+    def load():
+        result = query_db(LOAD_USER_QUERY, [id], True)
+        if result:
+            return User(result['username'], id, result['is_admin'],
+                    result['is_active'])
+    # Flask-Login only checks is_active() in login_user, a deactivated
+    # user's session must stop working here
+    user = cache.users.get(int(id), load)
+    if user is None or not user.is_active():
+        return Anonymous()
+    return user
 
 login_manager.setup_app(app)
 login_manager.anonymous_user = Anonymous
@@ -102,56 +182,64 @@ login_manager.anonymous_user = Anonymous
 
 # Helper functions
 
+def configure_pool():
+    # re-read the database settings, e.g. after app.config was changed
+    pool.configure(app.config['DATABASE'],
+            size=app.config['DATABASE_POOL_SIZE'],
+            timeout=app.config['DATABASE_POOL_TIMEOUT'],
+            pragmas=get_pragmas(app.config), factory=get_factory())
+    snapshot.configure(app.config['DATABASE'], app.config['SNAPSHOT'],
+            app.config['SNAPSHOT_REFRESH_INTERVAL'],
+            app.config['SNAPSHOT_CHECK_INTERVAL'])
+
+
+def data_changed():
+    # after a write was committed, outside requests call this by hand
+    pages.data_changed()
+    snapshot.mark_stale()
+
+
 def connect_db():
-    return sqlite3.connect(app.config['DATABASE'])
+    return pool.connect()
 
 def get_connection():
     db = getattr(g, 'db', None)
     if db is None:
-        db = g.db = connect_db()
+        db = g.db = pool.acquire()
     return db
 
 
-def query_db(query, args=(), one=False):
-    cur = g.db.execute(query, args)
-    rv = [dict((cur.description[idx][0], value)
-        for idx, value in enumerate(row)) for row in cur.fetchall()]
-    return (rv[0] if rv else None) if one else rv
-
+def query_db(query, args=(), one=False, read_only=None):
+    # read_only defaults to the view's @read_only marker
+    if read_only is None:
+        read_only = getattr(g, 'read_only', False)
+    result = snapshot.query(query, args) if read_only else None
+    if result is not None:
+        cur, rows = result
+    else:
+        cur = get_connection().execute(query, args)
+        rows = cur.fetchmany(1) if one else cur.fetchall()
+    if one:
+        return make_records(cur, rows[:1])[0] if rows else None
+    return make_records(cur, rows)
 
-def get_divisions(season_id, form=False):
-    # find populated divisions for a season
-    query = """SELECT DISTINCT division FROM signups
-    WHERE season_id = ? ORDER BY division ASC"""
-    values = [season_id]
-    cur = g.db.execute(query, values)
-    division_numbers = cur.fetchall()
 
-    # return None if no divisions are populated
-    if not division_numbers:
-        return None
+def iter_query(query, args=(), size=500):
+    # like query_db but fetches `size` rows at a time
+    cur = get_connection().execute(query, args)
+    return iter_records(cur, size)
 
-    divisions = []
 
-    # fetch divisions
-    query = """
-    SELECT user_id, username, division FROM signups
-    LEFT JOIN users ON users.id = user_id
-    WHERE season_id = ?
-    AND division = ?
-    """
-    for i in division_numbers:
-        i = i[0]
-        if i:
-            values = (season_id, unicode(i))
-            division = query_db(query, values)
-            if form:
-                for i in range(len(division)):
-                    division[i]['form'] = RemoveDivisionForm()
-                    division[i]['form'].season_id.data = season_id
-                    division[i]['form'].user_id.data = division[i]['user_id']
-                    division[i]['form'].season_id.divisions = None
-            divisions.append(division)
+def get_divisions(season_id, form=False):
+    divisions = Season(season_id).get_divisions()
+    if divisions and form:
+        for division in divisions:
+            for i, player in enumerate(division):
+                player_form = RemoveDivisionForm()
+                player_form.season_id.data = season_id
+                player_form.user_id.data = player['id']
+                player_form.season_id.divisions = None
+                division[i] = dict(player, form=player_form)
 
     return divisions
 
@@ -173,26 +261,41 @@ def get_login_form():
 
 
 def register_user(username, email, password, admin=False):
-    query = """
-    INSERT INTO users(username, email, password, is_admin)
-    VALUES(?, ?, ?, ?)
-    """
-    values = [username, email, bcrypt.generate_password_hash(password), admin]
-    cur = g.db.execute(query, values)
+    register_users([(username, email, password, admin)])
+
+
+def register_users(users):
+    # [(username, email, password, admin)], hashed in parallel
+    users = list(users)
+    hashes = hasher.generate_many(password for username, email, password,
+            admin in users)
+    start = time.time()
+    user_ids = []
+    for (username, email, password, admin), pw_hash in zip(users, hashes):
+        query = """
+        INSERT INTO users(username, email, password, is_admin)
+        VALUES(?, ?, ?, ?)
+        """
+        cur = g.db.execute(query, (username, email, pw_hash, admin))
+        user_ids.append(cur.lastrowid)
 
     query = """
     INSERT INTO signups(season_id, user_id)
     VALUES(?, ?)
     """
-    values = (1, cur.lastrowid)
-    g.db.execute(query, values)
+    g.db.executemany(query, [(1, user_id) for user_id in user_ids])
     g.db.commit()
+    hasher.timings.record('db', time.time() - start)
+    for user_id in user_ids:
+        cache.users.invalidate(user_id)
 
 
 def create_season():
     query = 'INSERT INTO seasons DEFAULT VALUES'
     g.db.execute(query)
     g.db.commit()
+    cache.reference.invalidate()
+    cache.navigation.invalidate()
 
 
 def create_maps():
@@ -206,17 +309,15 @@ def create_maps():
             ]
     g.db.executemany(query, maps)
     g.db.commit()
+    cache.reference.invalidate()
 
 
 def setup(username='admin', email='admin@localhost', password='pass'):
-    f = open('wsw/schema.sql', 'r')
-    script = unicode(f.read())
-    g.db.executescript(script)
-    g.db.commit()
+    migrations.reset(g.db)
+    cache.invalidate_all()
     create_season()
-    register_user(username, email, password, admin=True)
-    for i in range(20):
-        register_user('user' + str(i), str(i) + '@user', 'pass', False)
+    register_users([(username, email, password, True)] +
+            [('user%i' % i, '%i@user' % i, 'pass', False) for i in range(20)])
     create_maps()
 
 
@@ -1,14 +1,19 @@
 from datetime import datetime
 
-from flask import Blueprint
-from flask import redirect, request, g, flash, render_template, url_for
+import json
+import sqlite3
+
+from flask import Blueprint, stream_with_context
+from flask import (redirect, request, g, flash, render_template, url_for,
+        abort, current_app)
 from flask.ext.login import current_user
 from flask.ext.wtf import (Form, BooleanField, TextField, HiddenField,
         IntegerField, validators, SelectField, SubmitField,
         SelectMultipleField, RadioField, DateTimeField)
 
-from wsw.forms import is_unique
-from wsw.league import Season
+from wsw import archive, cache, jobs, search, standings, tracing
+from wsw.forms import UniqueUserForm
+from wsw.league import Season, update_listing_username
 
 admin = Blueprint('admin', __name__, template_folder="templates/admin")
 
@@ -42,17 +47,28 @@ def get_divisions(season):
             form.season_id.data = season.id
             form.user_id.data = divisions[i][j]['id']
             form.season_id.divisions = None
-            divisions[i][j]['form'] = form
+            divisions[i][j] = dict(divisions[i][j], form=form)
 
     return divisions
 
 
+def flash_batch(message, users, failed):
+    done = len(set(users)) - len(failed)
+    if done:
+        flash("%s (%i players)" % (message, done))
+    if failed:
+        flash("Failed for user ids: %s" % ', '.join(str(i) for i in failed))
+
+
 def set_user_field(user_id, field, value):
     query = 'UPDATE users SET ' + field + ' = ? WHERE id = ?'
     values = (value, user_id)
     cur = g.db.execute(query, values)
     if cur.rowcount:
+        if field == 'username':
+            update_listing_username(user_id, value)
         g.db.commit()
+        cache.users.invalidate(int(user_id))
         return True
     g.db.rollback()
     return False
@@ -70,23 +86,31 @@ def set_user_active(user_id, value):
 
 @admin.before_request
 def restrict_to_admins():
-    if not current_user.is_admin():
-        flash("Admins only")
-        return redirect(url_for('index'))
+    from wsw import LOAD_USER_QUERY, query_db
+    if current_user.is_admin():
+        # the cached user may predate a demotion or deactivation made in
+        # another process, admin routes go by the database
+        user_id = int(current_user.get_id())
+        result = query_db(LOAD_USER_QUERY, [user_id], True, read_only=False)
+        if result and result['is_admin'] and result['is_active']:
+            return
+        cache.users.invalidate(user_id)
+    flash("Admins only")
+    return redirect(url_for('index'))
 
 
 # Forms
 
 class SeasonForm(Form):
-    signup_limit = TextField("Signup Limit")
+    signup_limit = IntegerField("Signup Limit", default=0,
+            validators=[validators.Optional(), validators.NumberRange(min=0)])
     signups_open = BooleanField("Signups Open")
     submit = SubmitField("Update")
 
 
 class SignupForm(Form):
     season_id = HiddenField(validators=[validators.Required()])
-    user_id = SelectField(u"", validators=[validators.Required()],
-            coerce=int)
+    username = TextField(u"Player", validators=[validators.Required()])
     submit = SubmitField("Add")
 
 
@@ -105,6 +129,24 @@ class DivisionForm(Form):
     submit = SubmitField("Submit")
 
 
+class FillDivisionsForm(Form):
+    season_id = HiddenField(validators=[validators.Required()])
+    size = IntegerField(u"Players per division", default=8,
+            validators=[validators.NumberRange(min=2)])
+    submit = SubmitField("Fill divisions")
+
+
+class SeedDivisionsForm(Form):
+    season_id = HiddenField(validators=[validators.Required()])
+    size = IntegerField(u"Players per division", default=8,
+            validators=[validators.NumberRange(min=2)])
+    order = SelectField(u"Seed by", default='rating',
+            choices=[('rating', 'Rating'),
+                ('position', 'Previous season position')])
+    preview = SubmitField("Preview")
+    submit = SubmitField("Seed divisions")
+
+
 class RemoveMapForm(MapPoolForm):
     map_id = HiddenField(validators=[validators.Required()])
 
@@ -124,10 +166,9 @@ class RemoveSignupForm(Form):
     user_id = HiddenField(validators=[validators.Required()])
 
 
-class NewUserForm(Form):
-    username = TextField('Username',
-            [validators.Length(min=4, max=25), is_unique])
-    email = TextField('Email Address', [validators.Required(), is_unique])
+class NewUserForm(UniqueUserForm):
+    username = TextField('Username', [validators.Length(min=4, max=25)])
+    email = TextField('Email Address', [validators.Required()])
 
 
 class NewMapForm(Form):
@@ -142,12 +183,30 @@ class GenerateMatchesForm(Form):
             validators=[validators.Required()])
     submit = SubmitField("Generate")
 
+class ResultForm(Form):
+    game_id = HiddenField(validators=[validators.Required()])
+    map_id = SelectField(u"Map")
+    alpha_score = IntegerField(validators=[validators.NumberRange(min=0)])
+    beta_score = IntegerField(validators=[validators.NumberRange(min=0)])
+    submit = SubmitField("Save")
+
 # Routes
 
 
 @admin.route("/")
 def index():
-    return render_template("admin/index.html")
+    from wsw import pool, hasher, snapshot
+    cache_stats = [
+            ('Reference data', cache.reference.stats()),
+            ('Navigation', cache.navigation.stats()),
+            ('Users', cache.users.stats()),
+            ('Pages', cache.pages.stats()),
+            ]
+    return render_template("admin/index.html", pool_stats=pool.stats(),
+            snapshot_stats=snapshot.stats(),
+            cache_stats=cache_stats, login_timings=hasher.timings.stats(),
+            sql_trace=current_app.config['SQL_TRACE'],
+            sql_stats=tracing.recorder.stats())
 
 
 @admin.route("/league")
@@ -155,18 +214,52 @@ def league():
     return redirect(url_for('.signups', id=Season.get_current_season_id()))
 
 
+@admin.route("/season/<id>", methods=['GET', 'POST'])
+def season(id):
+    season = Season(id)
+    season.load()
+
+    form = SeasonForm(request.form)
+    if request.method == 'POST':
+        if form.validate_on_submit():
+            season.signup_limit = form.signup_limit.data or 0
+            season.signups_open = form.signups_open.data
+            if season.save():
+                flash("Season updated")
+            else:
+                flash("Failed to update season")
+        else:
+            flash("Failed to update season")
+
+    if not form.errors:
+        form.signup_limit.data = season.signup_limit
+        form.signups_open.data = season.signups_open
+
+    add_user_form = SignupForm()
+    add_user_form.season_id.data = id
+
+    return render_template("admin/season.html", season=season, form=form,
+            signups=season.get_signups(), add_user_form=add_user_form)
+
+
 @admin.route("/add_signup", methods=['POST'])
 def add_signup():
     form = SignupForm(request.form)
+    query = 'SELECT id FROM users WHERE username = ? COLLATE NOCASE'
+    user = g.db.execute(query, (form.username.data,)).fetchone()
+    if user is None:
+        flash("No such user")
+        return redirect(request.referrer)
+
     query = """
     INSERT INTO signups(season_id, user_id) VALUES(?, ?)
     """
-    values = (form.season_id.data, form.user_id.data)
-    cur = g.db.execute(query, values)
-    if cur.rowcount:
+    values = (form.season_id.data, user[0])
+    try:
+        g.db.execute(query, values)
         flash("User added")
         g.db.commit()
-    else:
+    except sqlite3.IntegrityError:
         flash("Couldn't add user")
         g.db.rollback()
 
@@ -202,6 +295,7 @@ def remove_map_from_pool():
         if cur.rowcount:
             flash("Map removed")
             g.db.commit()
+            cache.reference.invalidate(('map_pool', int(form.season_id.data)))
         else:
             flash("Failed to removed map")
             g.db.rollback()
@@ -225,6 +319,7 @@ def map_pool(id):
         if cur.rowcount:
             flash("Map added to the pool")
             g.db.commit()
+            cache.reference.invalidate(('map_pool', int(form.season_id.data)))
         else:
             flash("Failed to add map")
             g.db.rollback()
@@ -235,6 +330,19 @@ def map_pool(id):
     return render_template("admin/map_pool.html", form=form, season=season)
 
 
+@admin.route("/season/<int:id>/archive.<format>.gz")
+def season_archive(id, format):
+    # streamed while it is written, with chunked transfer encoding
+    if format not in archive.FORMATS or not Season(id).exists():
+        abort(404)
+    response = current_app.response_class(
+            stream_with_context(archive.stream(id, format)),
+            mimetype='application/gzip')
+    response.headers['Content-Disposition'] = 'attachment; filename=%s' % (
+            archive.filename(id, format))
+    return response
+
+
 @admin.route("/signups/<id>", methods=['GET', 'POST'])
 def signups(id):
     season = Season(id)
@@ -244,10 +352,13 @@ def signups(id):
     form.user_id.choices = season.get_unasigned_signup_list()
     if request.method == 'POST' and form.validate_on_submit():
         if form.user_id.data:
-            if form.action.data == "assign" and season.add_to_division(form.division.data, form.user_id.data):
-                flash("Division assigned")
-            elif form.action.data == "remove" and season.remove_signups(form.user_id.data):
-                flash("Signups removed")
+            if form.action.data == "assign":
+                failed = season.add_to_division(form.division.data,
+                        form.user_id.data)
+                flash_batch("Division assigned", form.user_id.data, failed)
+            elif form.action.data == "remove":
+                failed = season.remove_signups(form.user_id.data)
+                flash_batch("Signups removed", form.user_id.data, failed)
             else:
                 flash("Failed")
         else:
@@ -258,12 +369,64 @@ def signups(id):
 
     add_user_form = SignupForm()
     add_user_form.season_id.data = id
-    add_user_form.user_id.choices = season.get_users_for_signup()
 
-    divisions = get_divisions(season)
+    fill_form = FillDivisionsForm()
+    fill_form.season_id.data = id
+
+    seed_form = SeedDivisionsForm()
+    seed_form.season_id.data = id
 
     return render_template("admin/signups.html", season=season, form=form,
-            signups=season.get_signups(), add_user_form=add_user_form)
+            signups=season.get_signups(), add_user_form=add_user_form,
+            fill_form=fill_form, seed_form=seed_form)
+
+
+@admin.route("/fill_divisions", methods=['POST'])
+def fill_divisions():
+    form = FillDivisionsForm(request.form)
+    if form.validate_on_submit():
+        season = Season(form.season_id.data)
+        divisions, failed = season.fill_divisions(form.size.data)
+        if divisions:
+            flash("Created divisions %s" % ', '.join(str(i) for i in divisions))
+        elif failed:
+            flash("No divisions created, no sign-up for user ids: %s" %
+                    ', '.join(str(i) for i in failed))
+        else:
+            flash("Not enough players on the waiting list")
+    else:
+        flash("Failed to fill divisions")
+    return redirect(request.referrer or url_for('.signups',
+        id=form.season_id.data))
+
+
+@admin.route("/seed_divisions", methods=['POST'])
+def seed_divisions():
+    form = SeedDivisionsForm(request.form)
+    if not form.validate_on_submit():
+        flash("Failed to seed divisions")
+        return redirect(request.referrer or url_for('.signups',
+            id=form.season_id.data))
+
+    season = Season(form.season_id.data)
+    if form.preview.data:
+        divisions, failed = season.seed_divisions(form.size.data,
+                form.order.data, dry_run=True)
+        return render_template("admin/seed_divisions.html", season=season,
+                form=form, divisions=divisions)
+
+    divisions, failed = season.seed_divisions(form.size.data,
+            form.order.data)
+    if divisions:
+        flash("Seeded %i players into divisions %i-%i" % (
+            sum(len(players) for division, players in divisions),
+            divisions[0][0], divisions[-1][0]))
+    elif failed:
+        flash("No divisions seeded, no sign-up for user ids: %s" %
+                ', '.join(str(i) for i in failed))
+    else:
+        flash("Not enough players on the waiting list")
+    return redirect(url_for('.signups', id=season.id))
 
 
 @admin.route("/users")
@@ -279,6 +442,18 @@ def new_user():
     return render_template("admin/new_user.html", form=form)
 
 
+@admin.route("/users/search")
+def search_users():
+    # ?q=<prefix>[&season_id=<leave out its signups>][&limit=<n>]
+    season_id = request.args.get('season_id', type=int)
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    users = search.search_users(request.args.get('q', u''), limit,
+            season_id)
+    return current_app.response_class(json.dumps([{'id': id,
+        'username': username} for id, username in users]),
+        mimetype='application/json')
+
+
 @admin.route("/demote_user/<id>", methods=["POST"])
 def demote_user(id):
     if id == current_user.id:
@@ -347,25 +522,80 @@ def matches(id):
     form = GenerateMatchesForm(request.form)
     if request.method == 'POST' and form.validate_on_submit():
         season = Season(form.season_id.data)
-        maps = form.maps.data
-        interval = form.interval.data
-        start = form.first_default_time.data
-
-        for division in season.get_division_numbers():
-            if season.create_matches(division, maps, start, interval):
-                flash("Generated matches for division " + str(division))
-            else:
-                flash("Failed to generate matches for division " + str(division))
+        divisions = season.get_division_numbers()
+        if divisions:
+            jobs.enqueue('create_matches', season_id=int(season.id),
+                    divisions=divisions, maps=form.maps.data,
+                    start=form.first_default_time.data.strftime(
+                        '%Y-%m-%d %H:%M:%S'),
+                    interval=form.interval.data)
+            flash("Generating matches for %i divisions" % len(divisions))
+            return redirect(url_for('.jobs_list'))
+        flash("No divisions to generate matches for")
 
     season = Season(id)
     season.load()
 
     form.season_id.data = id
 
-    divisions = get_divisions(season)
+    after = request.args.get('after', None, type=int)
+    limit = current_app.config['MATCHES_PAGE_SIZE']
+    # one extra row tells whether there is a next page
+    matches = season.get_matches_page(after, limit + 1)
+    next_page = matches[limit - 1].id if len(matches) > limit else None
+    matches = matches[:limit]
+    has_matches = bool(matches) or season.has_matches()
 
     return render_template("admin/matches.html", season=season, form=form,
-            matches=season.get_matches())
+            matches=matches, next_page=next_page, has_matches=has_matches)
+
+@admin.route("/match/<season_id>/<id>", methods=['GET', 'POST'])
+def match(season_id, id):
+    season = Season(season_id)
+    season.load()
+
+    form = ResultForm(request.form)
+    form.map_id.choices = [(m['id'], m['name']) for m in season.get_map_pool()]
+    if request.method == 'POST' and form.validate_on_submit():
+        if standings.record_result(id, form.game_id.data, form.map_id.data,
+                form.alpha_score.data, form.beta_score.data):
+            flash("Result recorded")
+        else:
+            flash("Failed to record result")
+
+    match = season.get_match(id)
+    if not match:
+        abort(404)
+
+    return render_template("admin/match.html", season=season, form=form,
+            match=match, games=season.get_games(id))
+
+
+@admin.route("/rebuild_standings/<id>", methods=['POST'])
+def rebuild_standings(id):
+    jobs.enqueue('rebuild_standings', season_id=int(id))
+    flash("Rebuilding standings")
+    return redirect(url_for('.jobs_list'))
+
+
+@admin.route("/rebuild_ratings", methods=['POST'])
+def rebuild_ratings():
+    jobs.enqueue('rebuild_ratings')
+    flash("Rebuilding ratings")
+    return redirect(url_for('.jobs_list'))
+
+
+@admin.route("/jobs")
+def jobs_list():
+    return render_template("admin/jobs.html", jobs=jobs.get_jobs())
+
+
+@admin.route("/jobs/status")
+def jobs_status():
+    # polled by the jobs page
+    return current_app.response_class(json.dumps([dict(zip(job.keys(), job))
+        for job in jobs.get_jobs()]), mimetype='application/json')
+
 
 @admin.route("/generate_matches", methods=['POST'])
 def generate_matches():
@@ -375,7 +605,7 @@ def generate_matches():
 def maps():
     from wsw import query_db
     query = "SELECT * FROM MAPS"
-    maps = query_db(query)
+    maps = cache.reference.get('maps', lambda: query_db(query))
     form = NewMapForm(request.form)
 
     return render_template("admin/maps.html", maps=maps, form=form)
@@ -386,10 +616,13 @@ def delete_user(id):
     if id == current_user.id:
         flash("Can not delete your own account.")
     else:
+        update_listing_username(id, None)
         query = 'DELETE FROM users WHERE id = ?'
         cur = g.db.execute(query, [id])
         if cur.rowcount:
             flash("User deleted.")
             g.db.commit()
+            cache.navigation.invalidate()
+            cache.users.invalidate(int(id))
     return redirect(request.referrer or url_for("index"))
 
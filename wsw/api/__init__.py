@@ -0,0 +1,184 @@
+import hashlib
+import json
+from functools import wraps
+
+from flask import Blueprint, current_app, request
+
+from wsw import cache, pages
+from wsw.league import Season
+from wsw.snapshot import read_only
+
+api = Blueprint('api', __name__)
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+
+
+# Helpers
+
+def dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+def make_json_response(body, status=200):
+    response = current_app.response_class(body, status=status,
+            mimetype='application/json')
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+def json_view(view):
+    """Serializes the view's result, cached like the HTML pages.
+
+    The body is cached in cache.pages until the next write, so polling an
+    unchanged resource costs a dict lookup, or a 304 with If-None-Match.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        def load():
+            body = dumps(view(*args, **kwargs))
+            return body, hashlib.md5(body).hexdigest()
+
+        key = ('api', request.path, request.query_string)
+        try:
+            body, etag = cache.pages.get(key, load)
+        except ApiError as e:
+            return make_json_response(dumps({'error': e.message}), e.status)
+
+        response = make_json_response(body)
+        response.set_etag(etag)
+        response.last_modified = pages.data.get()[1]
+        response.headers['Cache-Control'] = 'public, no-cache'
+        return response.make_conditional(request)
+    return wrapper
+
+
+def get_fields():
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
+def to_dicts(records, fields=None):
+    # records -> dicts, limited to `fields` when given
+    items = []
+    for record in records:
+        keys = record.keys()
+        if fields is None:
+            items.append(dict(zip(keys, record)))
+            continue
+        unknown = [field for field in fields if field not in record]
+        if unknown:
+            raise ApiError(400, "Unknown fields: %s" % ', '.join(unknown))
+        items.append(dict((field, record[field]) for field in fields))
+    return items
+
+
+def get_int_arg(name, default=None, maximum=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(400, "%s must be an integer" % name)
+    if value < 1:
+        raise ApiError(400, "%s must be positive" % name)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def get_season(id):
+    if int(id) not in [row['id'] for row in Season.get_seasons_list()]:
+        raise ApiError(404, "No such season")
+    return Season(int(id))
+
+
+def divisions_to_dicts(divisions, fields):
+    return [{
+        'division': division[0]['division'],
+        'players': to_dicts(division, fields),
+        } for division in divisions or []]
+
+
+# Routes
+
+@api.route('/seasons')
+@read_only
+@json_view
+def seasons():
+    return {
+            'current': Season.get_current_season_id(),
+            'seasons': [row['id'] for row in Season.get_seasons_list()],
+            }
+
+
+@api.route('/seasons/<int:id>')
+@read_only
+@json_view
+def season(id):
+    season = get_season(id)
+    season.load()
+    return {
+            'id': season.id,
+            'signup_limit': season.signup_limit,
+            'signups_open': bool(season.signups_open),
+            }
+
+
+@api.route('/seasons/<int:id>/divisions')
+@read_only
+@json_view
+def divisions(id):
+    season = get_season(id)
+    return {'divisions': divisions_to_dicts(season.get_divisions(),
+        get_fields())}
+
+
+@api.route('/seasons/<int:id>/standings')
+@read_only
+@json_view
+def standings(id):
+    season = get_season(id)
+    return {'divisions': divisions_to_dicts(season.get_standings(),
+        get_fields())}
+
+
+@api.route('/seasons/<int:id>/signups')
+@read_only
+@json_view
+def signups(id):
+    season = get_season(id)
+    return {'signups': to_dicts(season.get_signups(), get_fields())}
+
+
+@api.route('/seasons/<int:id>/maps')
+@read_only
+@json_view
+def maps(id):
+    season = get_season(id)
+    return {'maps': to_dicts(season.get_map_pool(), get_fields())}
+
+
+@api.route('/seasons/<int:id>/matches')
+@read_only
+@json_view
+def matches(id):
+    # ?after=<next from the previous page>&limit=<n>
+    season = get_season(id)
+    limit = get_int_arg('limit', current_app.config['API_PAGE_SIZE'],
+            current_app.config['API_MAX_PAGE_SIZE'])
+    # one extra row tells whether there is a next page
+    matches = season.get_matches_page(get_int_arg('after'), limit + 1)
+    next_page = matches[limit - 1]['id'] if len(matches) > limit else None
+    return {
+            'matches': to_dicts(matches[:limit], get_fields()),
+            'next': next_page,
+            }
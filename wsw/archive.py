@@ -0,0 +1,145 @@
+"""Gzipped season archives, streamed section by section.
+
+JSON Lines archives hold one object per row with a "section" key. CSV
+archives start every section with a header row whose first column is
+"section", its rows then carry the section name in that column. Rows are
+fetched a few hundred at a time and compressed as they go. Matches and
+results are read in index order, the sections sorted by sqlite only hold
+a season's signups, so memory use doesn't grow with the number of games.
+"""
+import csv
+import json
+import zlib
+
+FORMATS = ('jsonl', 'csv')
+CHUNK_SIZE = 64 * 1024
+
+# (section, fields, query taking the season id)
+SECTIONS = [
+        ('season', ('id', 'signups_open', 'signup_limit', 'rules'), """
+        SELECT id, signups_open, signup_limit, rules FROM seasons
+        WHERE id = ?
+        """),
+        ('signups', ('user_id', 'username', 'division'), """
+        SELECT user_id, username, division FROM signups
+        LEFT JOIN users ON users.id = signups.user_id
+        WHERE season_id = ?
+        ORDER BY signups.rowid ASC
+        """),
+        ('divisions', ('division', 'user_id', 'username'), """
+        SELECT division, user_id, username FROM signups
+        LEFT JOIN users ON users.id = signups.user_id
+        WHERE season_id = ?
+        AND division > 0
+        ORDER BY division ASC, user_id ASC
+        """),
+        # season_maps.map_id is declared integer, compared as text the join
+        # can use maps' primary key
+        ('map_pool', ('map_id', 'name'), """
+        SELECT map_id, name FROM season_maps
+        LEFT JOIN maps ON maps.id = CAST(season_maps.map_id AS TEXT)
+        WHERE season_id = ?
+        ORDER BY map_id ASC
+        """),
+        ('matches', ('match_id', 'round', 'division', 'scheduled',
+            'alpha_id', 'alpha_username', 'beta_id', 'beta_username'), """
+        SELECT match_id, round, division, scheduled, alpha_id,
+        alpha_username, beta_id, beta_username
+        FROM match_listing
+        WHERE season_id = ?
+        ORDER BY round ASC, division ASC, scheduled ASC, match_id ASC
+        """),
+        # matches_season_id_idx and the results key give this order
+        ('results', ('match_id', 'game_id', 'map_id', 'alpha_score',
+            'beta_score'), """
+        SELECT match_id, game_id, map_id, alpha_score, beta_score
+        FROM results
+        JOIN matches ON matches.id = results.match_id
+        WHERE matches.season_id = ?
+        ORDER BY matches.id ASC, game_id ASC
+        """),
+        ('standings', ('division', 'position', 'user_id', 'username',
+            'points', 'wins', 'draws', 'losses', 'rating'), """
+        SELECT division, position, signups.user_id, username, points, wins,
+        draws, losses, season_ratings.rating
+        FROM signups
+        LEFT JOIN users ON users.id = signups.user_id
+        LEFT JOIN season_ratings
+        ON season_ratings.season_id = signups.season_id
+        AND season_ratings.user_id = signups.user_id
+        WHERE signups.season_id = ?
+        AND division > 0
+        ORDER BY division ASC, position IS NULL, position ASC,
+        signups.user_id ASC
+        """),
+        ]
+
+
+class LineWriter(object):
+    # csv.writer target keeping only the last row
+    def write(self, data):
+        self.data = data
+
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def iter_rows(season_id):
+    # (section, fields, row) for the whole season
+    from wsw import iter_query
+    for section, fields, query in SECTIONS:
+        for row in iter_query(query, (season_id,)):
+            yield section, fields, row
+
+
+def iter_jsonl(season_id):
+    for section, fields, row in iter_rows(season_id):
+        record = dict(zip(fields, row))
+        record['section'] = section
+        yield json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def iter_csv(season_id):
+    line = LineWriter()
+    writer = csv.writer(line)
+    current = None
+    for section, fields, row in iter_rows(season_id):
+        if section != current:
+            current = section
+            writer.writerow(('section',) + fields)
+            yield line.data
+        writer.writerow([section] + [encode(value) for value in row])
+        yield line.data
+
+
+def gzip_chunks(lines, level=6, size=CHUNK_SIZE):
+    # gzip stream of `lines` in pieces of roughly `size` input bytes
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    pending = []
+    length = 0
+    for data in lines:
+        pending.append(data)
+        length += len(data)
+        if length >= size:
+            chunk = compressor.compress(''.join(pending))
+            pending = []
+            length = 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(''.join(pending)) + compressor.flush()
+
+
+def stream(season_id, format='jsonl'):
+    """The gzipped archive of a season, as a generator of byte strings."""
+    if format not in FORMATS:
+        raise ValueError("Unknown archive format %r" % format)
+    lines = iter_jsonl(season_id) if format == 'jsonl' else iter_csv(
+            season_id)
+    return gzip_chunks(lines)
+
+
+def filename(season_id, format):
+    return 'season-%i.%s.gz' % (season_id, format)
@@ -0,0 +1,202 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from cStringIO import StringIO
+
+from flask import Blueprint, abort, current_app, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# Built into <static>/build by `manage.py build-assets`, served from /assets
+BUILD = 'build'
+MANIFEST = 'manifest.json'
+LEVELSHOTS = 'img/levelshots'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+MIN_COMPRESS_SIZE = 256
+
+assets = Blueprint('assets', __name__)
+
+_manifest = None
+
+
+def fingerprint(logical, data):
+    # css/bootstrap.min.css -> css/bootstrap.min.<hash>.css
+    root, ext = os.path.splitext(logical)
+    return '%s.%s%s' % (root, hashlib.md5(data).hexdigest()[:10], ext)
+
+
+def gzip_bytes(data):
+    out = StringIO()
+    # fixed mtime so rebuilding unchanged files gives identical bytes
+    f = gzip.GzipFile(filename='', mode='wb', fileobj=out, compresslevel=9,
+            mtime=0)
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+
+def write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_asset(target, logical, data, report):
+    name = fingerprint(logical, data)
+    path = os.path.join(target, name)
+    write(path, data)
+
+    sizes = {'original': len(data)}
+    if (os.path.splitext(logical)[1] in COMPRESSIBLE
+            and len(data) >= MIN_COMPRESS_SIZE):
+        compressed = gzip_bytes(data)
+        if len(compressed) < len(data):
+            write(path + '.gz', compressed)
+            sizes['gzip'] = len(compressed)
+        if brotli is not None:
+            compressed = brotli.compress(data)
+            if len(compressed) < len(data):
+                write(path + '.br', compressed)
+                sizes['brotli'] = len(compressed)
+    report[logical] = sizes
+    return name
+
+
+def make_thumbnails(source, size):
+    # (jpeg, webp or None) for one levelshot
+    image = Image.open(source)
+    image.thumbnail(size, Image.ANTIALIAS)
+    image = image.convert('RGB')
+
+    out = StringIO()
+    image.save(out, 'JPEG', quality=80, optimize=True, progressive=True)
+    jpeg = out.getvalue()
+
+    out = StringIO()
+    try:
+        image.save(out, 'WEBP', quality=75)
+        webp = out.getvalue()
+    except (IOError, KeyError):
+        # Pillow built without libwebp
+        webp = None
+    return jpeg, webp
+
+
+def build(static, thumbnail_size=(150, 150)):
+    target = os.path.join(static, BUILD)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+
+    manifest = {}
+    report = {}
+    for directory, dirs, files in os.walk(static):
+        if directory == static and BUILD in dirs:
+            dirs.remove(BUILD)
+        for filename in sorted(files):
+            if filename.startswith('.'):
+                continue
+            path = os.path.join(directory, filename)
+            logical = os.path.relpath(path, static).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                manifest[logical] = write_asset(target, logical, f.read(),
+                        report)
+
+    if Image is not None:
+        levelshots = os.path.join(static, LEVELSHOTS)
+        for filename in sorted(os.listdir(levelshots)):
+            root, ext = os.path.splitext(filename)
+            if ext.lower() not in ('.jpg', '.jpeg', '.png'):
+                continue
+            jpeg, webp = make_thumbnails(os.path.join(levelshots, filename),
+                    thumbnail_size)
+            logical = '%s/thumbs/%s.jpg' % (LEVELSHOTS, root)
+            manifest[logical] = write_asset(target, logical, jpeg, report)
+            if webp is not None:
+                logical = '%s/thumbs/%s.webp' % (LEVELSHOTS, root)
+                manifest[logical] = write_asset(target, logical, webp,
+                        report)
+
+    write(os.path.join(target, MANIFEST),
+            json.dumps(manifest, indent=2, sort_keys=True))
+    reset()
+    return report
+
+
+def reset():
+    global _manifest
+    _manifest = None
+
+
+def get_manifest():
+    global _manifest
+    if _manifest is None:
+        path = os.path.join(current_app.static_folder, BUILD, MANIFEST)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except IOError:
+            # not built, everything is served by the static handler
+            manifest = {}
+        _manifest = (manifest, frozenset(manifest.values()))
+    return _manifest
+
+
+def asset_url(filename):
+    """Like url_for('static', filename=...) but fingerprinted once built."""
+    name = get_manifest()[0].get(filename)
+    if name is None:
+        return url_for('static', filename=filename)
+    return url_for('assets.asset', filename=name)
+
+
+def levelshot(map_id):
+    # thumbnail urls, the full size jpeg if thumbnails weren't built
+    manifest = get_manifest()[0]
+    jpeg = '%s/thumbs/%s.jpg' % (LEVELSHOTS, map_id)
+    webp = '%s/thumbs/%s.webp' % (LEVELSHOTS, map_id)
+    if jpeg not in manifest:
+        jpeg = '%s/%s.jpg' % (LEVELSHOTS, map_id)
+    return {
+            'jpeg': asset_url(jpeg),
+            'webp': asset_url(webp) if webp in manifest else None,
+            }
+
+
+@assets.route('/<path:filename>')
+def asset(filename):
+    if filename not in get_manifest()[1]:
+        abort(404)
+
+    path = os.path.join(current_app.static_folder, BUILD, filename)
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if (candidate in request.accept_encodings
+                and os.path.exists(path + suffix)):
+            encoding = candidate
+            path += suffix
+            break
+
+    max_age = current_app.config['ASSETS_MAX_AGE']
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0],
+            conditional=True, cache_timeout=max_age)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    # the name changes with the content, so it never needs revalidating
+    response.headers['Cache-Control'] = 'public, max-age=%i, immutable' % (
+            max_age)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
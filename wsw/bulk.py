@@ -0,0 +1,344 @@
+"""Bulk user import and export.
+
+Imports read CSV (with a header row), JSON Lines or a JSON list of objects
+with username, email, password and optionally admin. Rows are validated
+and checked against existing users as they stream in, passwords are
+hashed on the hasher's worker processes and each batch of users and
+their signups is inserted in one transaction. Bad rows are reported with
+their line number and skipped.
+
+Exports stream users, signups and match history a few hundred rows at a
+time, as CSV or JSON Lines.
+"""
+import csv
+import json
+import re
+import sqlite3
+import time
+
+from flask import g
+
+from wsw import cache
+from wsw.league import CHUNK_SIZE, Season, chunked, placeholders
+
+
+FORMATS = ('csv', 'jsonl', 'json')
+TRUE = ('1', 'true', 'yes', 'y')
+SPACE = re.compile(r'\s*')
+NUMBER = '0123456789.eE+-'
+
+# (name, fields, query), password hashes are never exported
+EXPORTS = [
+        ('users', ('id', 'username', 'email', 'is_admin', 'is_active'), """
+        SELECT id, username, email, is_admin, is_active FROM users
+        ORDER BY id ASC
+        """),
+        ('signups', ('season_id', 'user_id', 'division', 'position',
+            'points', 'wins', 'draws', 'losses'), """
+        SELECT season_id, user_id, division, position, points, wins, draws,
+        losses
+        FROM signups
+        ORDER BY season_id ASC, user_id ASC
+        """),
+        ('matches', ('match_id', 'season_id', 'round', 'division',
+            'scheduled', 'alpha_id', 'alpha_username', 'beta_id',
+            'beta_username', 'game_id', 'map_id', 'alpha_score',
+            'beta_score'), """
+        SELECT match_listing.match_id, season_id, round, division,
+        scheduled, alpha_id, alpha_username, beta_id, beta_username,
+        game_id, map_id, alpha_score, beta_score
+        FROM match_listing
+        LEFT JOIN results ON results.match_id = match_listing.match_id
+        ORDER BY match_listing.match_id ASC, game_id ASC
+        """),
+        ]
+
+
+def get_exports(names=None):
+    # [(name, fields, query)] of `names`, all by default
+    if names is None:
+        return list(EXPORTS)
+    exports = dict((export[0], export) for export in EXPORTS)
+    unknown = [name for name in names if name not in exports]
+    if unknown:
+        raise ValueError("Unknown export %s, use one of %s" % (
+            ', '.join(unknown), ', '.join(export[0] for export in EXPORTS)))
+    return [exports[name] for name in names]
+
+
+def get_format(path, format=None):
+    if format is None:
+        format = path.rsplit('.', 1)[-1].lower()
+    if format not in FORMATS:
+        raise ValueError("Unknown format %r, use one of %s" % (format,
+            ', '.join(FORMATS)))
+    return format
+
+
+# Import
+
+def iter_json_list(f, size=64 * 1024, limit=1024 * 1024):
+    # The items of the JSON list in `f`, read `size` bytes at a time
+    # instead of loading the whole file. Raises ValueError when the file is
+    # malformed or an item is longer than `limit` bytes.
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    expect = 'list'
+    while True:
+        position = SPACE.match(buffer, position).end()
+        if position < len(buffer):
+            char = buffer[position]
+            if expect == 'list':
+                if char != '[':
+                    raise ValueError("not a JSON list")
+                position += 1
+                expect = 'first'
+                continue
+            if char == ']' and expect in ('first', 'separator'):
+                return
+            if expect == 'separator':
+                if char != ',':
+                    raise ValueError("expected ',' or ']'")
+                position += 1
+                expect = 'item'
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # maybe cut off at the end of the buffer
+                if eof or len(buffer) - position > limit:
+                    raise
+            else:
+                # only a number can go on in the next read
+                if eof or not isinstance(item, (int, long, float)) or (
+                        end < len(buffer) and buffer[end] not in NUMBER):
+                    position = end
+                    expect = 'separator'
+                    yield item
+                    continue
+        elif eof:
+            raise ValueError("unexpected end of file")
+        data = f.read(size)
+        eof = not data
+        buffer = buffer[position:] + data
+        position = 0
+
+
+def read_rows(f, format):
+    # (line number, dict) for every record in the file
+    if format == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            try:
+                yield reader.line_num, dict((key, value.decode('utf-8'))
+                        for key, value in row.iteritems()
+                        if key is not None and value is not None)
+            except UnicodeDecodeError as e:
+                yield reader.line_num, e
+    elif format == 'jsonl':
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, e
+    else:
+        number = 0
+        try:
+            for row in iter_json_list(f):
+                number += 1
+                yield number, row
+        except ValueError as e:
+            # the rest of the file can't be read
+            yield number + 1, e
+
+
+def get_text(row, name):
+    # JSON rows can hold any type, only strings are taken
+    value = row.get(name)
+    if value is None:
+        return u''
+    if not isinstance(value, basestring):
+        raise ValueError("%s must be a string" % name)
+    return unicode(value)
+
+
+def parse_user(row):
+    # (username, email, password, admin), raises ValueError
+    if isinstance(row, Exception):
+        raise ValueError(str(row))
+    if not isinstance(row, dict):
+        raise ValueError("not an object")
+    username = get_text(row, 'username').strip()
+    email = get_text(row, 'email').strip()
+    password = get_text(row, 'password')
+    admin = row.get('admin')
+    if isinstance(admin, (list, dict)):
+        raise ValueError("admin must be true or false")
+    if not 4 <= len(username) <= 25:
+        raise ValueError("username must be 4 to 25 characters")
+    if '@' not in email:
+        raise ValueError("invalid email address")
+    if not password:
+        raise ValueError("missing password")
+    if not isinstance(admin, bool):
+        admin = unicode(admin or u'').strip().lower() in TRUE
+    return username, email, password, admin
+
+
+def get_taken(users):
+    # the lowercased usernames and emails of `users` already in use
+    taken = set()
+    for chunk in chunked(users, CHUNK_SIZE / 2):
+        query = """
+        SELECT username, email FROM users
+        WHERE username COLLATE NOCASE IN (%s)
+        OR email COLLATE NOCASE IN (%s)
+        """ % (placeholders(chunk), placeholders(chunk))
+        values = [user[0] for user in chunk] + [user[1] for user in chunk]
+        for username, email in g.db.execute(query, values):
+            taken.add(username.lower())
+            taken.add(email.lower())
+    return taken
+
+
+class ImportReport(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.elapsed = 0.0
+        self.rows = 0
+        self.imported = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    def finish(self):
+        self.elapsed = time.time() - self.start
+
+    def __str__(self):
+        rate = self.imported / self.elapsed if self.elapsed else 0
+        return "%i rows in %.2fs: %i users imported (%.0f/s), %i errors" % (
+                self.rows, self.elapsed, self.imported, rate,
+                len(self.errors))
+
+
+def import_batch(batch, season_id, seen, report):
+    # [(line, user)], one transaction
+    taken = get_taken([user for line, user in batch])
+    users = []
+    for line, (username, email, password, admin) in batch:
+        for value, name in ((username, 'username'), (email, 'email')):
+            if value.lower() in taken or value.lower() in seen:
+                report.error(line, "%s %s is already in use" % (name, value))
+                break
+        else:
+            seen.update((username.lower(), email.lower()))
+            users.append((line, username, email, password, admin))
+    if not users:
+        return
+
+    from wsw import hasher
+    hashes = hasher.generate_many(user[3] for user in users)
+    user_ids = []
+    query = """
+    INSERT INTO users(username, email, password, is_admin)
+    VALUES(?, ?, ?, ?)
+    """
+    try:
+        for (line, username, email, password, admin), pw_hash in zip(users,
+                hashes):
+            try:
+                cur = g.db.execute(query, (username, email, pw_hash, admin))
+            except sqlite3.IntegrityError as e:
+                # only this statement is undone, the batch goes on
+                report.error(line, str(e))
+                continue
+            user_ids.append(cur.lastrowid)
+
+        if season_id is not None:
+            query = 'INSERT INTO signups(season_id, user_id) VALUES(?, ?)'
+            g.db.executemany(query, ((season_id, user_id)
+                for user_id in user_ids))
+        g.db.commit()
+    except Exception:
+        g.db.rollback()
+        raise
+    report.imported += len(user_ids)
+    for user_id in user_ids:
+        cache.users.invalidate(user_id)
+
+
+def import_users(f, format, season_id=None, signup=True, batch_size=500,
+        progress=None):
+    """Import the users in file object `f`, signed up for `season_id`.
+
+    `season_id` defaults to the current season, `signup=False` creates the
+    users only. `progress(rows)` is called after each batch. Returns an
+    ImportReport.
+    """
+    from wsw import data_changed
+    report = ImportReport()
+    if not signup:
+        season_id = None
+    elif season_id is None:
+        season_id = Season.get_current_season_id()
+
+    seen = set()
+    batch = []
+    for line, row in read_rows(f, format):
+        report.rows += 1
+        try:
+            batch.append((line, parse_user(row)))
+        except ValueError as e:
+            report.error(line, str(e))
+        if len(batch) >= batch_size:
+            import_batch(batch, season_id, seen, report)
+            batch = []
+            if progress:
+                progress(report.rows)
+    if batch:
+        import_batch(batch, season_id, seen, report)
+    if progress:
+        progress(report.rows)
+
+    if report.imported:
+        data_changed()
+    report.finish()
+    return report
+
+
+# Export
+
+def write_csv(f, fields, records):
+    writer = csv.writer(f)
+    writer.writerow(fields)
+    for record in records:
+        writer.writerow([value.encode('utf-8') if isinstance(value, unicode)
+            else value for value in record])
+
+
+def write_jsonl(f, fields, records):
+    for record in records:
+        f.write(json.dumps(dict(zip(fields, record))))
+        f.write('\n')
+
+
+def export(name, f, format):
+    """Write export `name` to file object `f`, returns the row count."""
+    from wsw import iter_query
+    name, fields, query = get_exports([name])[0]
+    count = [0]
+
+    def records():
+        for record in iter_query(query):
+            count[0] += 1
+            yield record
+    if format == 'csv':
+        write_csv(f, fields, records())
+    else:
+        write_jsonl(f, fields, records())
+    return count[0]
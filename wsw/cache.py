@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def hit_rate(hits, misses):
+    if not hits + misses:
+        return None
+    return float(hits) / (hits + misses)
+
+
+class LRUCache(object):
+    """Bounded cache evicting the least recently used entry.
+
+    Entries expire `ttl` seconds after being stored, which bounds how long
+    other processes can serve a value invalidated here. None is never
+    stored. With a `weigher` the entries' total weight, e.g. bytes, is
+    bounded by `maxsize` instead of their number.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, weigher=None):
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        self.weigher = weigher
+        self.weight = 0
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.configure(maxsize, ttl)
+
+    def configure(self, maxsize, ttl=None):
+        with self.lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._evict()
+
+    def _evict(self):
+        while self.weight > self.maxsize:
+            value, expires, weight = self.data.popitem(last=False)[1]
+            self.weight -= weight
+            self.evictions += 1
+
+    def get(self, key, load):
+        now = time.time()
+        with self.lock:
+            entry = self.data.pop(key, None)
+            if entry is not None:
+                if entry[1] is None or entry[1] > now:
+                    self.data[key] = entry
+                    self.hits += 1
+                    return entry[0]
+                self.weight -= entry[2]
+            self.misses += 1
+            version = self.version
+
+        value = load()
+
+        if value is not None:
+            expires = now + self.ttl if self.ttl else None
+            weight = self.weigher(value) if self.weigher else 1
+            with self.lock:
+                if version == self.version and weight <= self.maxsize:
+                    old = self.data.pop(key, None)
+                    if old is not None:
+                        self.weight -= old[2]
+                    self.data[key] = (value, expires, weight)
+                    self.weight += weight
+                    self._evict()
+        return value
+
+    def invalidate(self, key=None):
+        with self.lock:
+            self.version += 1
+            if key is None:
+                self.data.clear()
+                self.weight = 0
+            else:
+                entry = self.data.pop(key, None)
+                if entry is not None:
+                    self.weight -= entry[2]
+
+    def stats(self):
+        with self.lock:
+            return {
+                    'entries': len(self.data),
+                    'weight': self.weight,
+                    'version': self.version,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': hit_rate(self.hits, self.misses),
+                    }
+
+
+# Seasons, season settings, map pools and the map catalog, sized from
+# REFERENCE_CACHE_SIZE and REFERENCE_CACHE_TTL. Admin write paths
+# invalidate it explicitly, the TTL bounds how long other processes keep
+# serving the old values.
+reference = LRUCache()
+
+# Per-season match counts shown in the menu, sized from
+# NAVIGATION_CACHE_SIZE and NAVIGATION_CACHE_TTL
+navigation = LRUCache()
+
+# wsw.users.User by id for Flask-Login, sized from USER_CACHE_SIZE and
+# USER_CACHE_TTL
+users = LRUCache()
+
+# Rendered public pages, (html, fragments) bounded by PAGE_CACHE_BYTES.
+# Cleared whenever a request changed the database, see wsw.pages.
+pages = LRUCache(weigher=lambda entry: len(entry[0]))
+
+
+def invalidate_all():
+    # after the database was replaced or reset
+    for cache in (reference, navigation, users, pages):
+        cache.invalidate()
@@ -1,3 +1,90 @@
 DATABASE = 'wsw.db'
 DEBUG = True
 SECRET_KEY = 'key'
+
+# Connection pool
+DATABASE_POOL_SIZE = 5
+DATABASE_POOL_TIMEOUT = 10
+
+# Applied to every pooled connection
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_SYNCHRONOUS = 'NORMAL'
+SQLITE_CACHE_SIZE = -16000  # KiB when negative
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024
+SQLITE_BUSY_TIMEOUT = 5000  # ms
+
+# In-memory copy of the database for query_db() calls in @read_only views
+# or with read_only=True. Reloaded at most every SNAPSHOT_REFRESH_INTERVAL
+# seconds after a commit, reads use the file in between. Commits by other
+# processes are noticed within SNAPSHOT_CHECK_INTERVAL seconds.
+SNAPSHOT = False
+SNAPSHOT_REFRESH_INTERVAL = 2
+SNAPSHOT_CHECK_INTERVAL = 1
+
+# Per-request SQL tracing: X-SQL-* response headers and a summary on the
+# admin dashboard. Statement shapes run SQL_TRACE_REPEAT times or more in
+# one request are reported as likely N+1 queries.
+SQL_TRACE = False
+SQL_TRACE_REPEAT = 5
+
+# Seasons, season settings and map pools. The TTL bounds how long other
+# processes use them after an admin changed them.
+REFERENCE_CACHE_SIZE = 256
+REFERENCE_CACHE_TTL = 30  # seconds
+
+# Users loaded for Flask-Login sessions
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60  # seconds
+
+# Per-season match counts in the menu. The TTL bounds how long they stay
+# stale after matches were generated by `manage.py run-jobs` or another
+# process.
+NAVIGATION_CACHE_SIZE = 64
+NAVIGATION_CACHE_TTL = 30  # seconds
+
+# Password hashing, HASH_WORKERS processes (0 hashes on the request thread)
+# with at most HASH_QUEUE_LIMIT hashes pending
+BCRYPT_LOG_ROUNDS = 12
+HASH_WORKERS = 2
+HASH_QUEUE_LIMIT = 32
+HASH_TIMEOUT = 30  # seconds
+
+# Rendered public pages, cleared on every write. The TTL bounds how long
+# other processes serve pages from before a write made here.
+PAGE_CACHE_BYTES = 16 * 1024 * 1024
+PAGE_CACHE_TTL = 300  # seconds
+
+# Fingerprinted static files from `manage.py build-assets`
+ASSETS_MAX_AGE = 365 * 24 * 3600  # seconds
+LEVELSHOT_THUMBNAIL_SIZE = (150, 150)
+
+# Background jobs: worker threads per process (0 leaves them to
+# `manage.py run-jobs`). Running jobs without a heartbeat for
+# JOB_STALE_AFTER seconds are retried, up to JOB_MAX_ATTEMPTS times.
+JOB_WORKERS = 1
+JOB_POLL_INTERVAL = 2  # seconds
+JOB_HEARTBEAT = 10  # seconds
+JOB_STALE_AFTER = 60  # seconds
+JOB_MAX_ATTEMPTS = 3
+
+# Server stats ingestion: games written per transaction, parser processes
+# (None for one per CPU)
+INGEST_BATCH_SIZE = 500
+INGEST_WORKERS = None
+
+# Standings
+POINTS_WIN = 3
+POINTS_DRAW = 1
+POINTS_LOSS = 0
+
+# Elo ratings, `manage.py rebuild-ratings` is vectorized when numpy is
+# installed
+RATING_INITIAL = 1500.0
+RATING_K = 32
+
+# Admin match list
+MATCHES_PAGE_SIZE = 100
+
+# JSON API, matches per page unless ?limit= asks for up to the maximum
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
@@ -3,12 +3,35 @@ from flask.ext.wtf import (Form, TextField, PasswordField, BooleanField,
         validators, ValidationError)
 
 
-def is_unique(form, field):
-    query = 'SELECT COUNT(*) FROM users WHERE ' + field.id + ' = ?'
-    values = [field.data]
-    count = g.db.execute(query, values)
-    if(count.fetchone()[0]):
-        raise ValidationError(field.label.text + " is already in use")
+def unique_query(fields):
+    # One query for all `fields` instead of a COUNT(*) per field, compared
+    # case-insensitively like the login lookup. Takes the values twice.
+    return 'SELECT %s FROM users WHERE %s' % (
+            ', '.join('MAX(%s = ? COLLATE NOCASE)' % name for name in fields),
+            ' OR '.join('%s = ? COLLATE NOCASE' % name for name in fields))
+
+
+def check_unique(form, fields):
+    values = [form[name].data for name in fields]
+    row = g.db.execute(unique_query(fields), values * 2).fetchone()
+    unique = True
+    for name, taken in zip(fields, row):
+        if taken:
+            field = form[name]
+            field.errors = list(field.errors) + [
+                    field.label.text + " is already in use"]
+            unique = False
+    return unique
+
+
+class UniqueUserForm(Form):
+    """Rejects a username or email that another user already has."""
+
+    unique_fields = ('username', 'email')
+
+    def validate(self):
+        valid = Form.validate(self)
+        return check_unique(self, self.unique_fields) and valid
 
 
 class LoginForm(Form):
@@ -17,10 +40,9 @@ class LoginForm(Form):
     remember = BooleanField("Remember Me")
 
 
-class RegistrationForm(Form):
-    username = TextField('Username',
-            [validators.Length(min=4, max=25), is_unique])
-    email = TextField('Email Address', [validators.Required(), is_unique])
+class RegistrationForm(UniqueUserForm):
+    username = TextField('Username', [validators.Length(min=4, max=25)])
+    email = TextField('Email Address', [validators.Required()])
     password = PasswordField('New Password',
             [validators.Required(),
             validators.EqualTo('confirm', message='Passwords must match')])
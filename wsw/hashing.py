@@ -0,0 +1,139 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+
+from flask.ext.bcrypt import generate_password_hash, check_password_hash
+
+
+# Module level so the pool can pickle them
+
+def _generate(password, rounds):
+    return generate_password_hash(password, rounds)
+
+
+def _generate_args(args):
+    return _generate(*args)
+
+
+def _check(pw_hash, password):
+    return check_password_hash(pw_hash, password)
+
+
+def get_rounds(pw_hash):
+    # $2a$12$... -> 12
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class Timings(object):
+    """Count, total and slowest duration per named step."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            entry = self.data.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def stats(self):
+        with self.lock:
+            return dict((name, {
+                'count': count,
+                'total': total,
+                'mean': total / count,
+                'max': slowest,
+                }) for name, (count, total, slowest) in self.data.items())
+
+
+class Hasher(object):
+    """Runs bcrypt in a pool of worker processes.
+
+    At most `queue_limit` hashes are pending at once, further callers block
+    until a slot frees up. Batches from generate_many() take slots too, one
+    chunk of at most `workers` hashes at a time across all batches, which
+    leaves slots for logins. With no workers hashing happens in the calling
+    thread.
+    """
+
+    def __init__(self, workers=0, rounds=12, queue_limit=32, timeout=60):
+        self.pool = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.timings = Timings()
+        self.configure(workers, rounds, queue_limit, timeout)
+        atexit.register(self.close)
+
+    def configure(self, workers, rounds, queue_limit=32, timeout=60):
+        self.close()
+        self.workers = workers
+        self.rounds = rounds
+        self.timeout = timeout
+        self.queue_limit = queue_limit
+        self.slots = threading.BoundedSemaphore(queue_limit)
+        # one chunk in flight across all batches
+        self.batch_lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None and self.pid == os.getpid():
+                self.pool.terminate()
+            self.pool = None
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                self.pool = multiprocessing.Pool(self.workers)
+                self.pid = os.getpid()
+            return self.pool
+
+    def _run(self, func, *args):
+        start = time.time()
+        try:
+            if not self.workers:
+                return func(*args)
+            with self.slots:
+                result = self.get_pool().apply_async(func, args)
+                return result.get(self.timeout)
+        finally:
+            self.timings.record('hash', time.time() - start)
+
+    def generate(self, password):
+        return self._run(_generate, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        return self._run(_check, pw_hash, password)
+
+    def generate_many(self, passwords):
+        # hashes in parallel across the workers, in order. Logins wait for
+        # at most one chunk, not the whole batch.
+        passwords = list(passwords)
+        if not self.workers:
+            return [self.generate(password) for password in passwords]
+        size = max(1, min(self.workers, self.queue_limit - 1))
+        hashes = []
+        for i in range(0, len(passwords), size):
+            chunk = passwords[i:i + size]
+            start = time.time()
+            with self.batch_lock:
+                for password in chunk:
+                    self.slots.acquire()
+                try:
+                    result = self.get_pool().map_async(_generate_args,
+                            [(password, self.rounds) for password in chunk])
+                    hashes.extend(result.get(self.timeout * len(chunk)))
+                finally:
+                    for password in chunk:
+                        self.slots.release()
+            self.timings.record('hash', time.time() - start)
+        return hashes
+
+    def needs_rehash(self, pw_hash):
+        return get_rounds(pw_hash) != self.rounds
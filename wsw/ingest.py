@@ -0,0 +1,281 @@
+"""Load game results from Warsow server stats files.
+
+Each .json file holds one game, a list of games or {"games": [...]}, each
+.jsonl file one game per line. A game looks like
+
+    {"id": "...", "map": "wdm3", "players": [
+        {"name": "^1player", "score": 12}, {"name": "other", "score": 4}]}
+
+Games are matched to an unplayed game slot of the season's match between
+the two players, preferring a slot already set to that map, which must be
+one of the league's maps. Every game is
+keyed by its "id", or a hash of the whole record without one, so
+ingesting the same files twice changes nothing.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import time
+
+from flask import current_app, g
+
+from wsw import standings
+from wsw.league import Season, chunked, placeholders
+
+
+EXTENSIONS = ('.json', '.jsonl')
+COLOR = re.compile(r'\^[0-9]')
+
+# Games of the season's matches that have no result yet
+OPEN_SLOTS_QUERY = """
+SELECT results.match_id, game_id, map_id FROM results
+JOIN matches ON matches.id = results.match_id
+WHERE matches.season_id = ?
+AND (alpha_score IS NULL OR beta_score IS NULL)
+ORDER BY results.match_id ASC, game_id ASC
+"""
+
+INGESTED_QUERY = 'SELECT key FROM ingested_games WHERE key IN (%s)'
+
+
+def clean_name(name):
+    # Warsow colour codes, ^1name -> name
+    return COLOR.sub('', name).strip().lower()
+
+
+def normalize(raw):
+    # (key, map name, ((name, score), (name, score))), raises ValueError
+    if not isinstance(raw, dict):
+        raise ValueError("not a game object")
+    map_name = raw.get('map') or raw.get('mapname')
+    players = raw.get('players') or []
+    if not map_name or len(players) != 2:
+        raise ValueError("needs a map and two players")
+    if not isinstance(map_name, basestring):
+        raise ValueError("map must be a string")
+    try:
+        players = tuple((clean_name(p['name']), int(p['score']))
+                for p in players)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("players need a name and a numeric score")
+    key = raw.get('id') or raw.get('uuid')
+    if key is None:
+        key = hashlib.sha1(json.dumps(raw, sort_keys=True)).hexdigest()
+    return unicode(key), map_name.strip().lower(), players
+
+
+def parse_file(path):
+    # (path, games, errors), runs in the worker processes
+    games = []
+    errors = []
+    try:
+        with open(path) as f:
+            if path.endswith('.jsonl'):
+                records = (json.loads(line) for line in f if line.strip())
+            else:
+                records = json.load(f)
+                if isinstance(records, dict):
+                    records = records.get('games', [records])
+            for i, raw in enumerate(records):
+                try:
+                    games.append(normalize(raw))
+                except ValueError as e:
+                    errors.append("%s:%i: %s" % (path, i + 1, e))
+    except (IOError, ValueError) as e:
+        errors.append("%s: %s" % (path, e))
+    return path, games, errors
+
+
+def find_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    if filename.endswith(EXTENSIONS):
+                        yield os.path.join(directory, filename)
+        else:
+            yield path
+
+
+def parse_all(files, workers):
+    # parsing is spread over processes, writing stays in this one
+    if workers <= 1 or len(files) < 2 * workers:
+        for path in files:
+            yield parse_file(path)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap_unordered(parse_file, files, chunksize=8):
+            yield result
+    finally:
+        pool.terminate()
+
+
+class Report(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.elapsed = 0.0
+        self.files = 0
+        self.games = 0
+        self.ingested = 0
+        self.duplicates = 0
+        self.unmatched = 0
+        self.errors = []
+
+    def finish(self):
+        self.elapsed = time.time() - self.start
+
+    def __str__(self):
+        rate = self.games / self.elapsed if self.elapsed else 0
+        return ("%i files, %i games in %.2fs (%.0f games/s): %i ingested, "
+                "%i already ingested, %i unmatched, %i errors" % (
+                    self.files, self.games, self.elapsed, rate,
+                    self.ingested, self.duplicates, self.unmatched,
+                    len(self.errors)))
+
+
+class MatchIndex(object):
+    """The season's players, maps, matches and unplayed game slots."""
+
+    def __init__(self, season_id):
+        self.users = {}
+        for id, username in g.db.execute('SELECT id, username FROM users'):
+            self.users[clean_name(username)] = id
+
+        self.maps = {}
+        for id, name in g.db.execute('SELECT id, name FROM maps'):
+            self.maps.setdefault(name.lower(), id)
+            self.maps[id.lower()] = id
+
+        query = """
+        SELECT match_id, alpha_id, beta_id FROM match_listing
+        WHERE season_id = ?
+        ORDER BY match_id ASC
+        """
+        self.pairs = {}
+        self.alpha = {}
+        for match_id, alpha, beta in g.db.execute(query, (season_id,)):
+            self.pairs.setdefault(frozenset((alpha, beta)), []).append(
+                    match_id)
+            self.alpha[match_id] = alpha
+
+        self.slots = {}
+        for match_id, game_id, map_id in g.db.execute(OPEN_SLOTS_QUERY,
+                (season_id,)):
+            self.slots.setdefault(match_id, []).append([game_id, map_id])
+
+    def take(self, map_name, players):
+        # (match_id, game_id, map_id, alpha_score, beta_score) or None
+        (name, score), (other, other_score) = players
+        user_id = self.users.get(name)
+        other_id = self.users.get(other)
+        map_id = self.maps.get(map_name)
+        if user_id is None or other_id is None or map_id is None:
+            return None
+        for match_id in self.pairs.get(frozenset((user_id, other_id)), []):
+            slots = self.slots.get(match_id)
+            if not slots:
+                continue
+            slot = next((s for s in slots if s[1] == map_id),
+                    next((s for s in slots if s[1] is None), None))
+            if slot is None:
+                continue
+            slots.remove(slot)
+            if self.alpha[match_id] == user_id:
+                return match_id, slot[0], map_id, score, other_score
+            return match_id, slot[0], map_id, other_score, score
+        return None
+
+
+def get_ingested(keys):
+    ingested = set()
+    for chunk in chunked(keys):
+        query = INGESTED_QUERY % placeholders(chunk)
+        ingested.update(row[0] for row in g.db.execute(query, chunk))
+    return ingested
+
+
+def write_batch(batch, index, seen, report):
+    # one transaction per batch
+    seen.update(get_ingested([key for key, map_name, players, source
+        in batch if key not in seen]))
+    stale = set()
+    rows = []
+    now = time.time()
+    try:
+        for key, map_name, players, source in batch:
+            if key in seen:
+                report.duplicates += 1
+                continue
+            seen.add(key)
+            slot = index.take(map_name, players)
+            if slot is None:
+                # not marked as ingested, a later run may find its match
+                report.unmatched += 1
+                continue
+            match_id, game_id, map_id, alpha_score, beta_score = slot
+            changed = standings.apply_result(match_id, game_id, map_id,
+                    alpha_score, beta_score)
+            if changed:
+                stale.add(changed)
+            rows.append((key, match_id, game_id, source, now))
+
+        query = """
+        INSERT INTO ingested_games(key, match_id, game_id, source, ingested)
+        VALUES(?, ?, ?, ?, ?)
+        """
+        g.db.executemany(query, rows)
+        for season_id, division in stale:
+            standings.rank(season_id, division)
+        g.db.commit()
+    except Exception:
+        g.db.rollback()
+        raise
+    report.ingested += len(rows)
+
+
+def ingest(paths, season_id=None, workers=None, batch_size=None,
+        progress=None):
+    """Ingest every stats file under `paths` into `season_id`'s results.
+
+    `progress(files_done, files_total)` is called after each batch.
+    Returns a Report.
+    """
+    from wsw import data_changed
+    config = current_app.config
+    report = Report()
+    if season_id is None:
+        season_id = Season.get_current_season_id()
+    if workers is None:
+        workers = config['INGEST_WORKERS'] or multiprocessing.cpu_count()
+    if batch_size is None:
+        batch_size = config['INGEST_BATCH_SIZE']
+
+    files = list(find_files(paths))
+    index = MatchIndex(season_id)
+    seen = set()
+    batch = []
+    for path, games, errors in parse_all(files, workers):
+        report.files += 1
+        report.games += len(games)
+        report.errors.extend(errors)
+        source = os.path.basename(path)
+        batch.extend(game + (source,) for game in games)
+        if len(batch) >= batch_size:
+            write_batch(batch, index, seen, report)
+            batch = []
+            if progress:
+                progress(report.files, len(files))
+    if batch:
+        write_batch(batch, index, seen, report)
+    if progress:
+        progress(report.files, len(files))
+
+    if report.ingested:
+        data_changed()
+    report.finish()
+    return report
@@ -0,0 +1,302 @@
+import atexit
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import g
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# A single UPDATE is atomic, so two workers never get the same job
+CLAIM_QUERY = """
+UPDATE jobs SET state = ?, claim = ?, started = COALESCE(started, ?),
+heartbeat = ?, attempts = attempts + 1
+WHERE id = (SELECT id FROM jobs WHERE state = ? ORDER BY id LIMIT 1)
+AND state = ?
+"""
+
+REQUEUE_QUERY = """
+UPDATE jobs SET state = ?, claim = NULL
+WHERE state = ? AND heartbeat < ?
+"""
+
+# kind -> function(job, **args), returning a message for the admin
+handlers = {}
+
+
+def handler(kind):
+    def decorator(f):
+        handlers[kind] = f
+        return f
+    return decorator
+
+
+class Job(object):
+    """A claimed row of the jobs table, handed to its handler."""
+
+    def __init__(self, id, kind, args, claim):
+        self.id = id
+        self.kind = kind
+        self.args = args
+        self.claim = claim
+
+    def update(self, progress, total=None, message=None):
+        # Commits g.db, call it between steps, not inside a transaction
+        query = """
+        UPDATE jobs SET progress = ?, total = COALESCE(?, total),
+        message = COALESCE(?, message), heartbeat = ?
+        WHERE id = ? AND claim = ?
+        """
+        g.db.execute(query, (progress, total, message, time.time(), self.id,
+            self.claim))
+        g.db.commit()
+
+
+def enqueue(kind, **args):
+    if kind not in handlers:
+        raise ValueError("Unknown job kind %r" % kind)
+    query = 'INSERT INTO jobs(kind, args, created) VALUES(?, ?, ?)'
+    cur = g.db.execute(query, (kind, json.dumps(args), time.time()))
+    g.db.commit()
+    from wsw import runner
+    runner.wake()
+    return cur.lastrowid
+
+
+def get_jobs(limit=20):
+    from wsw import query_db
+    query = """
+    SELECT id, kind, state, progress, total, message, attempts, created,
+    started, finished
+    FROM jobs
+    ORDER BY id DESC
+    LIMIT ?
+    """
+    return query_db(query, (limit,))
+
+
+def requeue_stale(db, stale_after, max_attempts):
+    # running jobs whose worker stopped sending heartbeats, e.g. after a
+    # restart, run again from the start, their handlers skip finished steps
+    cutoff = time.time() - stale_after
+    query = """
+    UPDATE jobs SET state = ?, claim = NULL, message = ?, finished = ?
+    WHERE state = ? AND heartbeat < ? AND attempts >= ?
+    """
+    db.execute(query, (FAILED, "Gave up after %i attempts" % max_attempts,
+        time.time(), RUNNING, cutoff, max_attempts))
+    cur = db.execute(REQUEUE_QUERY, (QUEUED, RUNNING, cutoff))
+    db.commit()
+    return cur.rowcount
+
+
+def claim(db):
+    token = uuid.uuid4().hex
+    now = time.time()
+    cur = db.execute(CLAIM_QUERY, (RUNNING, token, now, now, QUEUED, QUEUED))
+    db.commit()
+    if not cur.rowcount:
+        return None
+    query = 'SELECT id, kind, args FROM jobs WHERE claim = ?'
+    id, kind, args = db.execute(query, (token,)).fetchone()
+    return Job(id, kind, json.loads(args), token)
+
+
+def finish(db, job, state, message):
+    query = """
+    UPDATE jobs SET state = ?, message = ?, finished = ?, claim = NULL
+    WHERE id = ? AND claim = ?
+    """
+    db.execute(query, (state, message, time.time(), job.id, job.claim))
+    db.commit()
+
+
+class JobRunner(object):
+    """Worker threads running jobs from the jobs table.
+
+    Running jobs send a heartbeat every `heartbeat` seconds. Jobs without
+    one for `stale_after` seconds are queued again, which resumes them
+    after a restart or a crashed process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.running = {}
+        self.last_error = None
+        atexit.register(self.stop, 1)
+
+    def configure(self):
+        config = self.app.config
+        self.workers = config['JOB_WORKERS']
+        self.poll_interval = config['JOB_POLL_INTERVAL']
+        self.heartbeat = config['JOB_HEARTBEAT']
+        self.stale_after = config['JOB_STALE_AFTER']
+        self.max_attempts = config['JOB_MAX_ATTEMPTS']
+
+    def start(self, workers=None):
+        with self.lock:
+            if self.threads:
+                return
+            self.configure()
+            if workers is not None:
+                self.workers = workers
+            self.stopping.clear()
+            targets = [self.work] * self.workers
+            if targets:
+                targets.append(self.beat)
+            for target in targets:
+                thread = threading.Thread(target=target)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        # a job still running after `timeout` is retried after a restart
+        with self.lock:
+            self.stopping.set()
+            self.wakeup.set()
+            threads, self.threads = self.threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def wake(self):
+        self.wakeup.set()
+
+    def work(self):
+        while not self.stopping.is_set():
+            try:
+                ran = self.run_next()
+                self.last_error = None
+            except Exception as e:
+                # e.g. the jobs table isn't migrated yet or the pool timed
+                # out, logged once and retried, the thread must not die
+                if str(e) != self.last_error:
+                    self.last_error = str(e)
+                    self.app.logger.exception("Job runner")
+                ran = False
+            if not ran:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+
+    def run_next(self):
+        with self.app.test_request_context():
+            self.app.preprocess_request()
+            # the test context resolves to a @read_only view
+            g.read_only = False
+            requeue_stale(g.db, self.stale_after, self.max_attempts)
+            job = claim(g.db)
+            if job is None:
+                return False
+            self.run(job)
+            return True
+
+    def run(self, job):
+        with self.lock:
+            self.running[job.id] = job.claim
+        try:
+            message = handlers[job.kind](job, **job.args)
+            state = DONE
+        except Exception as e:
+            g.db.rollback()
+            self.app.logger.exception("Job %i (%s)", job.id, job.kind)
+            state = FAILED
+            message = "%s: %s" % (type(e).__name__, e)
+        finally:
+            with self.lock:
+                del self.running[job.id]
+        finish(g.db, job, state, message)
+
+    def beat(self):
+        # own connection, the worker's may be busy in a transaction
+        from wsw import pool
+        db = None
+        while not self.stopping.wait(self.heartbeat):
+            with self.lock:
+                claims = self.running.values()
+            if not claims:
+                continue
+            try:
+                if db is None:
+                    db = pool.connect()
+                db.executemany('UPDATE jobs SET heartbeat = ? WHERE claim = ?',
+                        [(time.time(), token) for token in claims])
+                db.commit()
+            except sqlite3.Error:
+                self.app.logger.exception("Job heartbeat")
+        if db is not None:
+            db.close()
+
+
+# Job kinds
+
+@handler('create_matches')
+def create_matches(job, season_id, divisions, maps, start, interval):
+    # one division at a time, divisions that already have matches were
+    # done by an earlier attempt. A division that failed fails the job, the
+    # admin generates again to retry it.
+    from wsw.league import Season
+    season = Season(season_id)
+    start = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+    job.update(0, len(divisions))
+    created = 0
+    failed = []
+    for i, division in enumerate(divisions):
+        if not season.has_matches(division):
+            if season.create_matches(division, maps, start, interval):
+                created += 1
+            else:
+                failed.append(division)
+        job.update(i + 1)
+    if failed:
+        raise RuntimeError("No matches generated for divisions: %s (%i of "
+                "%i done)" % (', '.join(str(d) for d in failed),
+                    len(divisions) - len(failed), len(divisions)))
+    return "Generated matches for %i of %i divisions" % (created,
+            len(divisions))
+
+
+@handler('rebuild_standings')
+def rebuild_standings(job, season_id):
+    from wsw import standings
+    job.update(0, 1)
+    standings.rebuild(season_id)
+    job.update(1)
+    return "Rebuilt standings for season %i" % season_id
+
+
+@handler('rebuild_ratings')
+def rebuild_ratings(job):
+    from wsw import ratings
+    job.update(0, 1)
+    count = ratings.rebuild()
+    job.update(1)
+    return "Replayed %i matches" % count
+
+
+@handler('ingest_stats')
+def ingest_stats(job, paths, season_id=None):
+    from wsw import ingest
+    report = ingest.ingest(paths, season_id,
+            progress=lambda done, total: job.update(done, total))
+    return str(report)
+
+
+@handler('import_users')
+def import_users(job, path, format=None, season_id=None, signup=True):
+    from wsw import bulk
+    with open(path, 'rb') as f:
+        report = bulk.import_users(f, bulk.get_format(path, format),
+                season_id, signup, progress=job.update)
+    return "%s%s" % (report, ''.join("; line %i: %s" % error
+        for error in report.errors[:5]))
@@ -1,5 +1,138 @@
-from flask import g 
+import sqlite3
 from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from flask import g 
+
+from wsw import cache
+
+
+INTERVALS = {
+        'd': timedelta(days=1),
+        'w': timedelta(weeks=1),
+        }
+
+
+def round_robin(teams):
+    # Circle method, one list of (alpha, beta) pairs per round. None marks
+    # a bye when the number of teams is odd.
+    teams = list(teams)
+    if len(teams) % 2 == 1:
+        teams.append(None)
+
+    rounds = []
+    mid = len(teams) / 2
+    for i in range(len(teams) - 1):
+        l1 = teams[:mid]
+        l2 = teams[mid:]
+        l2.reverse()
+
+        # Switch sides after each round
+        if i % 2 == 1:
+            rounds.append(zip(l1, l2))
+        else:
+            rounds.append(zip(l2, l1))
+        teams.insert(1, teams.pop())
+
+    return rounds
+
+
+# Denormalized copy of matches and both players, written together with the
+# matches by Season.create_all_matches and kept in step with usernames by
+# update_listing_username
+MATCH_LISTING_QUERY = """
+SELECT match_id AS id, alpha_id, alpha_username, beta_id, beta_username,
+scheduled, round, division
+FROM match_listing
+WHERE season_id = ?
+%s
+ORDER BY round ASC, division ASC, scheduled ASC, match_id ASC
+"""
+
+# Keyset pagination of MATCH_LISTING_QUERY, after the given match id
+MATCHES_AFTER = """
+AND (round, division, scheduled, match_id) >
+(SELECT round, division, scheduled, match_id FROM match_listing
+WHERE match_id = ?)
+"""
+
+DIVISIONS_QUERY = """
+SELECT users.id, username, division FROM signups
+LEFT JOIN users ON users.id = user_id
+WHERE season_id = ?
+AND division > 0
+ORDER BY division ASC
+"""
+
+# Precomputed by wsw.standings
+STANDINGS_QUERY = """
+SELECT users.id, username, division, position, points, wins, draws,
+losses, season_ratings.rating AS rating
+FROM signups
+LEFT JOIN users ON users.id = signups.user_id
+LEFT JOIN season_ratings
+ON season_ratings.season_id = signups.season_id
+AND season_ratings.user_id = signups.user_id
+WHERE signups.season_id = ?
+AND division > 0
+ORDER BY division ASC, position IS NULL, position ASC, users.id ASC
+"""
+
+WAITING_LIST_QUERY = """
+SELECT users.id, users.username, signups.division
+FROM signups
+LEFT JOIN users ON users.id = signups.user_id
+WHERE signups.season_id = ? AND signups.division IS NULL
+ORDER BY signups.rowid ASC
+"""
+
+# Waiting players and what they are seeded by, see Season.get_seeds
+SEED_QUERIES = {
+        'rating': """
+        SELECT signups.user_id, ratings.rating FROM signups
+        JOIN ratings ON ratings.user_id = signups.user_id
+        WHERE signups.season_id = ?
+        AND signups.division IS NULL
+        """,
+        'position': """
+        SELECT user_id, division, position FROM signups
+        WHERE season_id = (SELECT MAX(id) FROM seasons WHERE id < ?)
+        AND division > 0
+        """,
+        }
+
+
+def update_listing_username(user_id, username):
+    # on renames, and with None before a user is deleted. Does not commit.
+    query = 'UPDATE match_listing SET alpha_username = ? WHERE alpha_id = ?'
+    g.db.execute(query, (username, user_id))
+    query = 'UPDATE match_listing SET beta_username = ? WHERE beta_id = ?'
+    g.db.execute(query, (username, user_id))
+
+
+def group_divisions(players):
+    # players ordered by division -> list of divisions, None when empty
+    if not players:
+        return None
+
+    return [list(division) for number, division
+            in groupby(players, itemgetter('division'))]
+
+
+# Bound parameters per IN (...) list, older sqlite builds allow 999 per
+# statement
+CHUNK_SIZE = 500
+
+
+def chunked(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def placeholders(items):
+    return ', '.join('?' * len(items))
 
 
 class Season:
@@ -15,160 +148,303 @@ class Season:
 
     def get_matches(self):
         from wsw import query_db
-        query = """
-        SELECT matches.id, auser.id, auser.username, buser.id, buser.username,
-        scheduled, round, division 
-        FROM matches
-        LEFT JOIN match_players AS alpha 
-        ON alpha.match_id = matches.id AND alpha.alpha = 1
-        LEFT JOIN users AS auser ON auser.id = alpha.user_id
-        LEFT JOIN match_players AS beta 
-        ON beta.match_id = matches.id AND beta.alpha = 0
-        LEFT JOIN users AS buser ON buser.id = beta.user_id
-        WHERE season_id = ?
-        ORDER BY round ASC, division ASC, scheduled ASC
-        """
-        values = (self.id)
-        cur = g.db.execute(query, values)
-        results = []
-        for row in cur.fetchall():
-            match = {
-                    'id' : row[0],
-                    'scheduled' : row[5],
-                    'round' : row[6],
-                    'division' : row[7],
-                    'alpha' : {
-                        'id' : row[1],
-                        'username' : row[2]
-                        },
-                    'beta' : {
-                        'id' : row[3],
-                        'username' : row[4]
-                        }
-                    }
-            results = results + [match]
-
-        return results
+        query = MATCH_LISTING_QUERY % ''
+        return query_db(query, (self.id,))
+
+
+    def iter_matches(self, round=None, division=None):
+        # lazily, optionally limited to one round and/or division
+        from wsw import iter_query
+        where = ''
+        values = [self.id]
+        if round is not None:
+            where += 'AND round = ? '
+            values.append(round)
+        if division is not None:
+            where += 'AND division = ? '
+            values.append(division)
+        return iter_query(MATCH_LISTING_QUERY % where, values)
+
+
+    def get_matches_page(self, after=None, limit=100):
+        # keyset pagination, `after` is the last match id of the previous
+        # page
+        from wsw import query_db
+        where = ''
+        values = [self.id]
+        if after is not None:
+            where = MATCHES_AFTER
+            values.append(after)
+        query = MATCH_LISTING_QUERY % where + 'LIMIT ?'
+        values.append(limit)
+        return query_db(query, values)
 
 
-    def create_matches(self, division_number, maps, start, interval):
+    def get_match(self, match_id):
+        from wsw import query_db
         query = """
-        SELECT user_id FROM signups
+        SELECT match_id AS id, alpha_id, alpha_username, beta_id,
+        beta_username, scheduled, round, division
+        FROM match_listing
         WHERE season_id = ?
-        AND division = ?
+        AND match_id = ?
         """
-        values = (self.id, division_number)
+        return query_db(query, (self.id, match_id), True)
 
-        cur = g.db.execute(query, values)
 
-        def get_id(arg):
-            return arg[0]
+    def get_games(self, match_id):
+        from wsw import query_db
+        query = """
+        SELECT game_id, map_id, alpha_score, beta_score FROM results
+        WHERE match_id = ?
+        ORDER BY game_id ASC
+        """
+        return query_db(query, (match_id,))
 
-        teams = map(get_id, cur.fetchall())
 
-        if len(teams) % 2 == 1: teams = teams + [None]
-        s = []
+    def has_matches(self, division=None):
+        # in one division, or in any with division=None
+        query = 'SELECT 1 FROM match_listing WHERE season_id = ? %s LIMIT 1'
+        if division is None:
+            cur = g.db.execute(query % '', (self.id,))
+        else:
+            cur = g.db.execute(query % 'AND division = ?', (self.id, division))
+        return cur.fetchone() is not None
 
-        for i in range(len(teams)-1):
 
-            mid = len(teams) / 2
-            l1 = teams[:mid]
-            l2 = teams[mid:]
-            l2.reverse()    
+    def create_matches(self, division_number, maps, start, interval):
+        return self.create_all_matches([division_number], maps, start,
+                interval)
 
-            # Switch sides after each round
-            if(i % 2 == 1):
-                s = s + [zip(l1, l2)]
-            else:
-                s = s + [zip(l2, l1)]
-            teams.insert(1, teams.pop())
 
-        if (interval == "w"):
-            td = timedelta(weeks=1)
-        elif (interval == "d"):
-            td = timedelta(days=1)
+    def create_all_matches(self, divisions, maps, start, interval):
+        query = """
+        SELECT division, user_id, username FROM signups
+        JOIN users ON users.id = user_id
+        WHERE season_id = ?
+        AND division > 0
+        ORDER BY division ASC
+        """
+        cur = g.db.execute(query, (self.id,))
+        players = {}
+        usernames = {}
+        for division, user_id, username in cur.fetchall():
+            players.setdefault(division, []).append(user_id)
+            usernames[user_id] = username
+
+        # Build the whole schedule before touching the database
+        td = INTERVALS[interval]
+        schedule = []
+        for division in divisions:
+            rounds = round_robin(players.get(int(division), []))
+            for round, pairs in enumerate(rounds):
+                scheduled = start + (round * td)
+                for alpha, beta in pairs:
+                    if alpha is None or beta is None:
+                        continue  # bye
+                    schedule.append((scheduled, division, round, alpha, beta))
 
-        for round in range(len(s)):
-            for match in s[round]:
-                # Match
-                query = """
-                INSERT INTO matches(season_id, scheduled, division, round)
-                VALUES(?, ?, ?, ?)
-                """
+        if not schedule:
+            return False
 
-                scheduled = start + (round * td)
-                values = (self.id, scheduled, division_number, round)
-                cur = g.db.execute(query, values)
-                if not cur.rowcount:
-                    # TODO log
-                    g.db.rollback()
-                    return False
-
-                # Players
-                match_id = cur.lastrowid
-                query = """
-                INSERT INTO match_players(match_id, user_id, alpha)
-                VALUES(?, ?, ?)
-                """
-                values = ((match_id, match[0], True), (match_id, match[1], False))
-                cur = g.db.executemany(query, values)
-                if cur.rowcount != 2:
-                    g.db.rollback()
-                    return False
-
-                # Maps
-                values = []
-                for i in range(maps):
-                    values = values + [ (match_id, i) ]
-                query = """
-                INSERT INTO results(match_id, game_id)
-                VALUES(?, ?)
-                """
-                cur = g.db.executemany(query, values)
-                if cur.rowcount != maps:
-                    g.db.rollback()
-                    return False
+        try:
+            query = """
+            INSERT INTO matches(season_id, scheduled, division, round)
+            VALUES(?, ?, ?, ?)
+            """
+            scheduled, division, round = schedule[0][:3]
+            cur = g.db.execute(query, (self.id, scheduled, division, round))
+
+            # The first insert holds the write lock until commit, so the
+            # ids following it are ours to assign
+            first_id = cur.lastrowid
+            matches = []
+            match_players = []
+            listing = []
+            results = []
+            for i, (scheduled, division, round, alpha, beta) in enumerate(
+                    schedule):
+                match_id = first_id + i
+                matches.append((match_id, self.id, scheduled, division, round))
+                match_players.append((match_id, alpha, True))
+                match_players.append((match_id, beta, False))
+                listing.append((match_id, self.id, round, division, scheduled,
+                    alpha, usernames[alpha], beta, usernames[beta]))
+                for game_id in range(maps):
+                    results.append((match_id, game_id))
+
+            query = """
+            INSERT INTO matches(id, season_id, scheduled, division, round)
+            VALUES(?, ?, ?, ?, ?)
+            """
+            g.db.executemany(query, matches[1:])
+
+            query = """
+            INSERT INTO match_players(match_id, user_id, alpha)
+            VALUES(?, ?, ?)
+            """
+            g.db.executemany(query, match_players)
+
+            query = """
+            INSERT INTO results(match_id, game_id)
+            VALUES(?, ?)
+            """
+            g.db.executemany(query, results)
+
+            query = """
+            INSERT INTO match_listing(match_id, season_id, round, division,
+            scheduled, alpha_id, alpha_username, beta_id, beta_username)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """
+            g.db.executemany(query, listing)
+        except sqlite3.Error:
+            # TODO log
+            g.db.rollback()
+            return False
 
         g.db.commit()
+        cache.navigation.invalidate()
         return True
 
 
-    def remove_signups(self, users):
-        query = """
-        DELETE FROM signups 
-        WHERE season_id = ?
-        AND user_id IN (?)
-        """
+    def get_signed_up(self, users):
+        # the subset of `users` signed up for this season
+        signed_up = set()
+        for chunk in chunked(users):
+            query = """
+            SELECT user_id FROM signups
+            WHERE season_id = ?
+            AND user_id IN (%s)
+            """ % placeholders(chunk)
+            cur = g.db.execute(query, [self.id] + chunk)
+            signed_up.update(row[0] for row in cur.fetchall())
+        return signed_up
+
+
+    def is_signed_up(self, user_id):
+        query = 'SELECT 1 FROM signups WHERE season_id = ? AND user_id = ?'
+        return g.db.execute(query, (self.id, user_id)).fetchone() is not None
+
 
-        for user_id in users:
-            values = (self.id, user_id)
-            cur = g.db.execute(query, values)
-            if not cur.rowcount:
-                g.db.rollback()
-                return False
+    def remove_signups(self, users):
+        # returns the user ids that were not signed up
+        users = sorted(set(int(user_id) for user_id in users))
+        signed_up = self.get_signed_up(users)
+        for chunk in chunked(sorted(signed_up)):
+            query = """
+            DELETE FROM signups
+            WHERE season_id = ?
+            AND user_id IN (%s)
+            """ % placeholders(chunk)
+            g.db.execute(query, [self.id] + chunk)
 
         g.db.commit()
-        return True
+        return [user_id for user_id in users if user_id not in signed_up]
 
 
     def add_to_division(self, division, users):
+        # returns the user ids that could not be assigned
+        users = sorted(set(int(user_id) for user_id in users))
         if division <= 0:
-            return False
+            return users
+
+        failed = self.assign_divisions([(division, users)])
+        g.db.commit()
+        return failed
 
-        query = """
-        UPDATE signups SET division = ?
-        WHERE season_id = ? 
-        AND user_id = ?
-        """
-        for user_id in users:
-            values = (division, self.id, user_id)
-            cur = g.db.execute(query, values)
-            if not cur.rowcount:
-                g.db.rollback()
-                return False
+
+    def assign_divisions(self, divisions):
+        # [(division, user ids)], one UPDATE per chunk of players. Does not
+        # commit, returns the user ids without a signup.
+        failed = []
+        for division, users in divisions:
+            for chunk in chunked(users):
+                query = """
+                UPDATE signups SET division = ?
+                WHERE season_id = ?
+                AND user_id IN (%s)
+                """ % placeholders(chunk)
+                cur = g.db.execute(query, [division, self.id] + chunk)
+                if cur.rowcount != len(chunk):
+                    signed_up = self.get_signed_up(chunk)
+                    failed.extend(user_id for user_id in chunk
+                            if user_id not in signed_up)
+        return failed
+
+
+    def fill_divisions(self, size):
+        # Split the waiting list, in signup order, into new divisions of
+        # `size` players. Leftover players stay on the waiting list. Returns
+        # (new divisions, user ids without a signup), nothing is assigned
+        # when any user id failed.
+        if size < 2:
+            return [], []
+
+        waiting = [player['id'] for player in self.get_waiting_list()]
+        query = 'SELECT MAX(division) FROM signups WHERE season_id = ?'
+        first = (g.db.execute(query, (self.id,)).fetchone()[0] or 0) + 1
+
+        divisions = []
+        for i in range(0, len(waiting) - size + 1, size):
+            divisions.append((first + len(divisions), waiting[i:i + size]))
+
+        failed = self.assign_divisions(divisions)
+        if failed:
+            g.db.rollback()
+            return [], failed
 
         g.db.commit()
-        return True
+        return [division for division, users in divisions], []
+
+
+    def get_seeds(self, order='rating'):
+        # user id -> sort key of the waiting players that have one, better
+        # players sort first. 'rating' is the current rating, 'position'
+        # the previous season's (division, position).
+        if order not in SEED_QUERIES:
+            raise ValueError("Unknown seeding order %r" % order)
+        cur = g.db.execute(SEED_QUERIES[order], (self.id,))
+        if order == 'rating':
+            return dict((user_id, (-rating,)) for user_id, rating in cur)
+        return dict((user_id, (division, position is None, position))
+                for user_id, division, position in cur)
+
+
+    def seed_divisions(self, size, order='rating', dry_run=False):
+        # Split the whole waiting list into new divisions of about `size`
+        # players whose sizes differ by at most one, best seeds first and
+        # unseeded players last in signup order. Returns ([(division,
+        # [(user id, username, seed)])], user ids without a signup), like
+        # fill_divisions nothing is assigned when any user id failed.
+        if size < 2:
+            return [], []
+        seeds = self.get_seeds(order)
+        players = [(player['id'], player['username'], seeds.get(player['id']))
+                for player in self.get_waiting_list()]
+        if len(players) < 2:
+            return [], []
+        players.sort(key=lambda player: (player[2] is None, player[2]))
+
+        count = max(1, int(round(float(len(players)) / size)))
+        query = 'SELECT MAX(division) FROM signups WHERE season_id = ?'
+        first = (g.db.execute(query, (self.id,)).fetchone()[0] or 0) + 1
+        divisions = []
+        start = 0
+        for i in range(count):
+            end = start + len(players) / count + (i < len(players) % count)
+            divisions.append((first + i, players[start:end]))
+            start = end
+        if dry_run:
+            return divisions, []
+
+        failed = self.assign_divisions([(division,
+            [player[0] for player in group]) for division, group in divisions])
+        if failed:
+            g.db.rollback()
+            return [], failed
+
+        g.db.commit()
+        return divisions, []
 
 
     def remove_from_division(self, user_id):
@@ -210,7 +486,7 @@ class Season:
         LEFT JOIN users ON users.id = user_id
         WHERE season_id = ? AND signups.division IS NULL
         """
-        cur = g.db.execute(query, (self.id))
+        cur = g.db.execute(query, (self.id,))
         return cur.fetchall()
 
 
@@ -221,18 +497,12 @@ class Season:
         LEFT JOIN users ON users.id = user_id
         WHERE season_id = ?
         """
-        return query_db(query, (self.id))
+        return query_db(query, (self.id,))
 
 
     def get_waiting_list(self):
         from wsw import query_db
-        query = """
-        SELECT users.id, users.username, signups.division
-        FROM signups
-        LEFT JOIN users ON users.id = signups.user_id
-        WHERE signups.season_id = ? AND signups.division IS NULL
-        """
-        return query_db(query, (self.id))
+        return query_db(WAITING_LIST_QUERY, (self.id,))
 
     def get_map_pool(self):
         from wsw import query_db
@@ -241,7 +511,8 @@ class Season:
         LEFT JOIN maps ON maps.id = map_id
         WHERE season_id = ?
         """
-        return query_db(query, (self.id))
+        return cache.reference.get(('map_pool', int(self.id)),
+                lambda: query_db(query, (self.id,)))
 
     def get_maps_not_in_pool(self):
         query = """
@@ -249,39 +520,42 @@ class Season:
         WHERE id NOT IN
         (SELECT map_id FROM season_maps WHERE season_id = ?)
         """
-        cur = g.db.execute(query, (self.id))
+        cur = g.db.execute(query, (self.id,))
         return cur.fetchall()
 
-    def get_users_for_signup(self):
-        query = """
-        SELECT id, username FROM users
-        WHERE id NOT IN
-        (SELECT user_id FROM signups WHERE season_id = ?)
-        """
-        return g.db.execute(query, (self.id))
-
-    
     def get_division_numbers(self):
         from wsw import query_db
         query = """
         SELECT MAX(division) as max FROM signups
         WHERE season_id = ? ORDER BY division ASC
         """
-        max = query_db(query, (self.id), True)['max']
+        max = query_db(query, (self.id,), True)['max']
         if max:
             return range(1, max+1)
         return None
 
 
     def get_divisions(self):
-        divisions_numbers = self.get_division_numbers()
-        if divisions_numbers:
-            divisions = []
-            for i in divisions_numbers:
-                divisions = divisions + [self.get_division(i)]
-            return divisions
+        # every populated division in a single pass
+        from wsw import query_db
+        return group_divisions(query_db(DIVISIONS_QUERY, (self.id,)))
 
-        return None
+
+    def get_standings(self):
+        from wsw import query_db
+        return group_divisions(query_db(STANDINGS_QUERY, (self.id,)))
+
+
+    def get_ratings(self):
+        # end of season ratings, or the current ones while it runs
+        from wsw import query_db
+        query = """
+        SELECT users.id, username, rating, matches FROM season_ratings
+        JOIN users ON users.id = user_id
+        WHERE season_id = ?
+        ORDER BY rating DESC, users.id ASC
+        """
+        return query_db(query, (self.id,))
 
 
     def get_division(self, division):
@@ -303,25 +577,49 @@ class Season:
                 return
             id = self.id
         query = 'SELECT * FROM seasons WHERE id = ?'
-        data = query_db(query, (id), True)
+        data = cache.reference.get(('season', int(id)),
+                lambda: query_db(query, (id,), True))
         self.signup_limit = data['signup_limit']
         self.signups_open = data['signups_open']
 
 
+    def exists(self):
+        query = 'SELECT 1 FROM seasons WHERE id = ?'
+        return g.db.execute(query, (self.id,)).fetchone() is not None
+
+
+    def save(self):
+        query = """
+        UPDATE seasons SET signup_limit = ?, signups_open = ?
+        WHERE id = ?
+        """
+        values = (self.signup_limit, self.signups_open, self.id)
+        cur = g.db.execute(query, values)
+        if cur.rowcount:
+            g.db.commit()
+            cache.reference.invalidate(('season', int(self.id)))
+            return True
+
+        g.db.rollback()
+        return False
+
+
     @staticmethod
     def get_current_season_id():
-        query = 'SELECT id FROM seasons ORDER BY id DESC LIMIT 1'
-        cur = g.db.execute(query)
-        season = cur.fetchone()
-        if season:
-            return season[0]
-        return None
+        def load():
+            query = 'SELECT id FROM seasons ORDER BY id DESC LIMIT 1'
+            cur = g.db.execute(query)
+            season = cur.fetchone()
+            if season:
+                return season[0]
+            return None
+        return cache.reference.get('current_season', load)
 
 
     @staticmethod
     def get_seasons_list():
         from wsw import query_db
         query = 'SELECT id FROM seasons'
-        return query_db(query)
+        return cache.reference.get('seasons', lambda: query_db(query))
 
 
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+
+
+SCHEMA = os.path.join(os.path.dirname(__file__), 'schema.sql')
+
+USER_SEARCH_FTS = """
+CREATE VIRTUAL TABLE users_fts USING fts5(username, content='users',
+content_rowid='id', prefix='2 3');
+CREATE TRIGGER users_fts_insert AFTER INSERT ON users BEGIN
+    INSERT INTO users_fts(rowid, username) VALUES(new.id, new.username);
+END;
+CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN
+    INSERT INTO users_fts(users_fts, rowid, username)
+    VALUES('delete', old.id, old.username);
+END;
+CREATE TRIGGER users_fts_update AFTER UPDATE OF username ON users BEGIN
+    INSERT INTO users_fts(users_fts, rowid, username)
+    VALUES('delete', old.id, old.username);
+    INSERT INTO users_fts(rowid, username) VALUES(new.id, new.username);
+END;
+INSERT INTO users_fts(users_fts) VALUES('rebuild');
+"""
+
+
+def has_fts5(db):
+    try:
+        db.execute('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)')
+    except sqlite3.OperationalError:
+        return False
+    db.execute('DROP TABLE temp.fts5_probe')
+    return True
+
+
+def add_user_search(db):
+    # Without FTS5 wsw.search falls back to prefix ranges on the NOCASE
+    # username index
+    db.execute('CREATE INDEX users_email_nocase_idx '
+            'ON users(email COLLATE NOCASE)')
+    if has_fts5(db):
+        for statement in split_statements(USER_SEARCH_FTS):
+            db.execute(statement)
+
+
+# (version, description, SQL script or callable taking the connection)
+# schema.sql is version 0. Never edit an applied migration, add a new one.
+MIGRATIONS = [
+        (1, "Indexes for season, division, player and login lookups", """
+        CREATE INDEX IF NOT EXISTS matches_season_idx
+        ON matches(season_id, round, division, scheduled);
+        CREATE INDEX IF NOT EXISTS match_players_user_idx
+        ON match_players(user_id);
+        CREATE INDEX IF NOT EXISTS signups_division_idx
+        ON signups(season_id, division);
+        CREATE INDEX IF NOT EXISTS users_username_nocase_idx
+        ON users(username COLLATE NOCASE);
+        """),
+        (2, "Key results by match and game", """
+        CREATE TABLE results_new (
+            match_id integer not null,
+            game_id integer not null,
+            map_id string default null,
+            alpha_score default null,
+            beta_score default null,
+            FOREIGN KEY(match_id) REFERENCES matches(id) ON DELETE CASCADE,
+            PRIMARY KEY(match_id, game_id)
+        );
+        INSERT INTO results_new(match_id, game_id, map_id, alpha_score,
+        beta_score)
+        SELECT match_id, game_id, map_id, alpha_score, beta_score
+        FROM results;
+        DROP TABLE results;
+        ALTER TABLE results_new RENAME TO results;
+        """),
+        (3, "Denormalized match listing", """
+        CREATE TABLE match_listing (
+            match_id integer not null primary key,
+            season_id integer not null,
+            round integer default null,
+            division integer default null,
+            scheduled integer default null,
+            alpha_id integer default null,
+            alpha_username string default null,
+            beta_id integer default null,
+            beta_username string default null,
+            FOREIGN KEY(match_id) REFERENCES matches(id) ON DELETE CASCADE,
+            FOREIGN KEY(alpha_id) REFERENCES users(id) ON DELETE SET NULL,
+            FOREIGN KEY(beta_id) REFERENCES users(id) ON DELETE SET NULL
+        );
+        CREATE INDEX match_listing_order_idx
+        ON match_listing(season_id, round, division, scheduled, match_id);
+        CREATE INDEX match_listing_alpha_idx ON match_listing(alpha_id);
+        CREATE INDEX match_listing_beta_idx ON match_listing(beta_id);
+        INSERT INTO match_listing(match_id, season_id, round, division,
+        scheduled, alpha_id, alpha_username, beta_id, beta_username)
+        SELECT matches.id, season_id, round, division, scheduled,
+        auser.id, auser.username, buser.id, buser.username
+        FROM matches
+        LEFT JOIN match_players AS alpha
+        ON alpha.match_id = matches.id AND alpha.alpha = 1
+        LEFT JOIN users AS auser ON auser.id = alpha.user_id
+        LEFT JOIN match_players AS beta
+        ON beta.match_id = matches.id AND beta.alpha = 0
+        LEFT JOIN users AS buser ON buser.id = beta.user_id;
+        """),
+        (4, "Background jobs", """
+        CREATE TABLE jobs (
+            id integer primary key autoincrement not null,
+            kind string not null,
+            args string not null default '{}',
+            state string not null default 'queued',
+            progress integer not null default 0,
+            total integer default null,
+            message string default null,
+            attempts integer not null default 0,
+            claim string default null,
+            created real default null,
+            started real default null,
+            heartbeat real default null,
+            finished real default null
+        );
+        CREATE INDEX jobs_state_idx ON jobs(state, id);
+        CREATE INDEX jobs_claim_idx ON jobs(claim);
+        """),
+        (5, "Ingested server stats", """
+        CREATE TABLE ingested_games (
+            key string not null primary key,
+            match_id integer not null,
+            game_id integer not null,
+            source string default null,
+            ingested real default null,
+            FOREIGN KEY(match_id) REFERENCES matches(id) ON DELETE CASCADE
+        );
+        CREATE INDEX ingested_games_match_idx
+        ON ingested_games(match_id, game_id);
+        """),
+        (6, "Player ratings", """
+        ALTER TABLE matches ADD COLUMN rating_delta real default null;
+        CREATE TABLE ratings (
+            user_id integer not null primary key,
+            rating real not null,
+            matches integer not null default 0,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        );
+        CREATE TABLE season_ratings (
+            season_id integer not null,
+            user_id integer not null,
+            rating real not null,
+            matches integer not null default 0,
+            FOREIGN KEY(season_id) REFERENCES seasons(id) ON DELETE CASCADE,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+            PRIMARY KEY(season_id, user_id)
+        );
+        CREATE INDEX season_ratings_user_idx
+        ON season_ratings(user_id, season_id);
+        """),
+        (7, "Case-insensitive email index and user search", add_user_search),
+        (8, "Index matches by season in id order", """
+        CREATE INDEX matches_season_id_idx ON matches(season_id, id);
+        """),
+        ]
+
+
+def get_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def get_latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def split_statements(script):
+    # ';' also ends statements inside trigger bodies, so only cut where
+    # sqlite agrees the statement is complete
+    statements = []
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \t\n;'):
+                statements.append(statement.strip())
+            statement = ''
+    return statements
+
+
+def migrate(db, target=None):
+    version = get_version(db)
+    applied = []
+
+    # The sqlite3 module commits before DDL on its own, take over
+    # transaction handling so each migration is all-or-nothing
+    db.commit()
+    isolation_level = db.isolation_level
+    db.isolation_level = None
+    try:
+        for number, description, migration in MIGRATIONS:
+            if number <= version:
+                continue
+            if target is not None and number > target:
+                break
+
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                if callable(migration):
+                    migration(db)
+                else:
+                    for statement in split_statements(migration):
+                        db.execute(statement)
+                db.execute('PRAGMA user_version = %i' % number)
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+            applied.append((number, description))
+    finally:
+        db.isolation_level = isolation_level
+
+    return applied
+
+
+def reset(db):
+    # Drop everything, including tables added by migrations, then rebuild
+    # the baseline schema and migrate it to the latest version
+    db.commit()
+    db.execute('PRAGMA foreign_keys = OFF')
+    query = """
+    SELECT name FROM sqlite_master
+    WHERE type = 'table'
+    AND name NOT LIKE 'sqlite_%'
+    ORDER BY sql LIKE 'CREATE VIRTUAL%' DESC
+    """
+    for (name,) in db.execute(query).fetchall():
+        db.execute('DROP TABLE IF EXISTS "%s"' % name)
+
+    db.executescript(unicode(open(SCHEMA).read()))
+    db.execute('PRAGMA user_version = 0')
+    db.execute('PRAGMA foreign_keys = ON')
+    return migrate(db)
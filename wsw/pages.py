@@ -0,0 +1,115 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from flask import Markup, current_app, g, request, session
+from flask.ext.login import current_user
+
+from wsw import cache
+
+
+class DataVersion(object):
+    """Bumped after every request that changed the database."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.modified = time.time()
+
+    def bump(self):
+        with self.lock:
+            self.version += 1
+            self.modified = time.time()
+
+    def get(self):
+        with self.lock:
+            return self.version, self.modified
+
+
+data = DataVersion()
+
+
+def data_changed():
+    # called at teardown when the connection's total_changes moved, and by
+    # anything writing outside a request
+    data.bump()
+    cache.pages.invalidate()
+
+
+# Per-user parts of otherwise shared pages: name -> function rendering it
+fragments = {}
+
+
+def fragment(name):
+    def decorator(f):
+        fragments[name] = f
+        return f
+    return decorator
+
+
+def marker(name):
+    return '<!--fragment:%s-->' % name
+
+
+def user_fragment(name, **context):
+    """Renders fragment `name`, or leaves a marker while caching a page."""
+    collected = getattr(g, 'page_fragments', None)
+    if collected is not None:
+        collected[name] = context
+        return Markup(marker(name))
+    return Markup(fragments[name](**context))
+
+
+def fill(body, collected):
+    for name, context in collected:
+        html = fragments[name](**context)
+        body = body.replace(marker(name), html.encode('utf-8'))
+    return body
+
+
+def cached_page(view):
+    """Caches a GET view's HTML until the next write.
+
+    Anonymous visitors share one copy. Logged-in users share another in
+    which user_fragment()s are re-rendered for every request. Responses
+    carry an ETag and Last-Modified so repeat visits can get a 304.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or '_flashes' in session:
+            return view(*args, **kwargs)
+
+        user = current_user.is_authenticated()
+        modified = data.get()[1]
+        key = (request.path, request.query_string, user)
+        rendered = []
+
+        def load():
+            g.page_fragments = {} if user else None
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            finally:
+                collected = g.page_fragments
+                g.page_fragments = None
+            rendered.append((response, collected))
+            if response.status_code == 200 and not response.is_streamed:
+                return response.data, sorted((collected or {}).items())
+
+        entry = cache.pages.get(key, load)
+        if entry is None:
+            # not cacheable, send what the view returned
+            response, collected = rendered[0]
+            if collected:
+                response.data = fill(response.data, sorted(collected.items()))
+            return response
+
+        body = fill(*entry)
+        response = current_app.response_class(body, mimetype='text/html')
+        response.set_etag(hashlib.md5(body).hexdigest())
+        response.last_modified = modified
+        response.headers['Cache-Control'] = '%s, no-cache' % (
+                'private' if user else 'public')
+        response.headers['Vary'] = 'Cookie'
+        return response.make_conditional(request)
+    return wrapper
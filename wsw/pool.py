@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import threading
+from Queue import LifoQueue, Empty
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def get_pragmas(config):
+    return [
+            'PRAGMA foreign_keys = ON',
+            'PRAGMA journal_mode = %s' % config['SQLITE_JOURNAL_MODE'],
+            'PRAGMA synchronous = %s' % config['SQLITE_SYNCHRONOUS'],
+            'PRAGMA cache_size = %i' % config['SQLITE_CACHE_SIZE'],
+            'PRAGMA mmap_size = %i' % config['SQLITE_MMAP_SIZE'],
+            'PRAGMA busy_timeout = %i' % config['SQLITE_BUSY_TIMEOUT'],
+            ]
+
+
+class ConnectionPool(object):
+    """Per-process pool of tuned sqlite connections.
+
+    Connections are created on demand up to `size`, after that callers wait
+    up to `timeout` seconds for one to be released.
+    """
+
+    def __init__(self, database, size=5, timeout=10, pragmas=(),
+            factory=sqlite3.Connection):
+        self.configure(database, size, timeout, pragmas, factory)
+
+    def configure(self, database, size=5, timeout=10, pragmas=(),
+            factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = list(pragmas)
+        self.factory = factory
+        self.reset()
+
+    def reset(self):
+        # connections inherited over a fork belong to the parent, ours that
+        # are still checked out are closed when they come back
+        retired = set()
+        if getattr(self, 'pid', None) == os.getpid():
+            self.close()
+            retired = self.retired | self.connections
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.idle = LifoQueue()
+        self.connections = set()
+        self.retired = retired
+        self.created = 0
+        self.in_use = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False,
+                factory=self.factory)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        # connections must not cross a fork
+        if self.pid != os.getpid():
+            self.reset()
+
+        try:
+            conn = self.idle.get_nowait()
+            with self.lock:
+                self.hits += 1
+                self.in_use += 1
+            return conn
+        except Empty:
+            pass
+
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+                self.misses += 1
+            else:
+                self.waits += 1
+
+        if create:
+            try:
+                conn = self.connect()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+            with self.lock:
+                self.connections.add(conn)
+        else:
+            try:
+                conn = self.idle.get(timeout=self.timeout)
+            except Empty:
+                with self.lock:
+                    self.timeouts += 1
+                raise PoolTimeout("No database connection available")
+
+        with self.lock:
+            self.in_use += 1
+        return conn
+
+    def release(self, conn):
+        if self.pid != os.getpid():
+            return
+
+        with self.lock:
+            current = conn in self.connections
+            if current:
+                self.in_use -= 1
+            else:
+                retired = conn in self.retired
+                self.retired.discard(conn)
+        if not current:
+            # checked out before a reset
+            if retired:
+                conn.close()
+            return
+
+        try:
+            # never hand out a connection with a transaction left open
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self.lock:
+                self.connections.discard(conn)
+                self.created -= 1
+            return
+
+        self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.connections.discard(conn)
+                self.created -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                    'size': self.size,
+                    'created': self.created,
+                    'idle': self.idle.qsize(),
+                    'in_use': self.in_use,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'waits': self.waits,
+                    'timeouts': self.timeouts,
+                    }
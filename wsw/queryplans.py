@@ -0,0 +1,64 @@
+import re
+import sqlite3
+
+import wsw
+from wsw import (archive, forms, ingest, jobs, league, migrations, ratings,
+        search, standings, views)
+
+
+# The queries run on every page or on every match night, with sample
+# arguments
+HOT_QUERIES = [
+        ('Season.get_matches_page', league.MATCH_LISTING_QUERY %
+            league.MATCHES_AFTER + 'LIMIT ?', (1, 1, 100)),
+        ('Season.iter_matches', league.MATCH_LISTING_QUERY % 'AND round = ?',
+            (1, 1)),
+        ('get_match_counts', wsw.MATCH_COUNTS_QUERY, (1,)),
+        ('Season.get_divisions', league.DIVISIONS_QUERY, (1,)),
+        ('Season.get_standings', league.STANDINGS_QUERY, (1,)),
+        ('Season.get_waiting_list', league.WAITING_LIST_QUERY, (1,)),
+        ('Season.get_seeds rating', league.SEED_QUERIES['rating'], (1,)),
+        ('Season.get_seeds position', league.SEED_QUERIES['position'], (2,)),
+        ('login', views.LOGIN_QUERY, ('admin',)),
+        ('load_user', wsw.LOAD_USER_QUERY, (1,)),
+        ('standings.get_outcome', standings.TALLY_QUERY % 'matches.id = ?',
+            (1,)),
+        ('standings.rebuild', standings.TALLY_QUERY %
+            'matches.season_id = ?', (1,)),
+        ('jobs.claim', jobs.CLAIM_QUERY, ('running', 'x', 0, 0, 'queued',
+            'queued')),
+        ('jobs.requeue_stale', jobs.REQUEUE_QUERY, ('queued', 'running', 0)),
+        ('ratings.get_user_ratings', ratings.SEASON_RATINGS_QUERY, (1,)),
+        ('search.RANGE_QUERY', search.RANGE_QUERY % search.NOT_SIGNED_UP,
+            ('ab', 'ac', 1, 10)),
+        ('search.FTS_QUERY', search.FTS_QUERY % '', ('"ab"*', 10)),
+        ('forms.check_unique', forms.unique_query(
+            forms.UniqueUserForm.unique_fields), ('a', 'b', 'a', 'b')),
+        ('ingest.MatchIndex', ingest.OPEN_SLOTS_QUERY, (1,)),
+        ('ingest.get_ingested', ingest.INGESTED_QUERY % '?, ?', ('a', 'b')),
+        ] + [('archive.' + section, query, (1,))
+            for section, fields, query in archive.SECTIONS]
+
+
+# "SCAN users" on recent sqlite, "SCAN TABLE users" on older versions.
+# "SCAN users_fts VIRTUAL TABLE INDEX ..." is an FTS index lookup.
+SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)\b(?! VIRTUAL TABLE)')
+
+
+def create_database():
+    db = sqlite3.connect(':memory:')
+    migrations.reset(db)
+    return db
+
+
+def find_full_scans(db, queries=HOT_QUERIES):
+    tables = set(row[0] for row in db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"))
+    scans = []
+    for name, query, args in queries:
+        for row in db.execute('EXPLAIN QUERY PLAN ' + query, args):
+            detail = row[-1]
+            match = SCAN.match(detail)
+            if match and match.group(1) in tables:
+                scans.append((name, detail))
+    return scans
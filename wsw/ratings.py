@@ -0,0 +1,239 @@
+"""Elo ratings from completed matches.
+
+A match scores 1, 0.5 or 0 for alpha by games won, and alpha gains
+RATING_K * (score - expected) while beta loses the same amount, so
+matches.rating_delta is enough to undo a rating change when a result is
+corrected. Ratings are updated as results come in, each match against
+the players' current ratings. `rebuild` replays the whole history the
+same way, one match at a time in HISTORY_QUERY order, so it reproduces
+results recorded in that order and is the repair path otherwise.
+
+A season's rating is the player's rating after their last match of that
+season. Correcting an old result moves it by the change in delta, later
+seasons keep theirs until the next rebuild.
+"""
+from flask import g, current_app
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Completed matches in the order they are rated, see standings.TALLY_QUERY
+HISTORY_QUERY = """
+SELECT matches.id, matches.season_id, matches.round,
+alpha.user_id, beta.user_id,
+SUM(results.alpha_score > results.beta_score),
+SUM(results.beta_score > results.alpha_score)
+FROM matches
+JOIN match_players AS alpha
+ON alpha.match_id = matches.id AND alpha.alpha = 1
+JOIN match_players AS beta
+ON beta.match_id = matches.id AND beta.alpha = 0
+JOIN results ON results.match_id = matches.id
+GROUP BY matches.id
+HAVING SUM(results.alpha_score IS NULL OR results.beta_score IS NULL) = 0
+ORDER BY matches.season_id ASC, matches.round ASC, matches.id ASC
+"""
+
+# A player's rating after each season they played in, newest first
+SEASON_RATINGS_QUERY = """
+SELECT season_id, rating, matches FROM season_ratings
+WHERE user_id = ?
+ORDER BY season_id DESC
+"""
+
+
+def score(alpha_games, beta_games):
+    if alpha_games > beta_games:
+        return 1.0
+    if alpha_games < beta_games:
+        return 0.0
+    return 0.5
+
+
+def expected(rating, other):
+    return 1 / (1 + 10 ** ((other - rating) / 400.0))
+
+
+def get_rating(user_id):
+    row = g.db.execute('SELECT rating FROM ratings WHERE user_id = ?',
+            (user_id,)).fetchone()
+    if row is None:
+        return current_app.config['RATING_INITIAL']
+    return row[0]
+
+
+def _adjust(season_id, user_id, delta, played):
+    # moves user_id's rating by delta and counts `played` more matches, in
+    # total and in season_id. A new season row starts from the current
+    # rating, after that it only moves by its own matches' deltas.
+    initial = current_app.config['RATING_INITIAL']
+    g.db.execute("""
+        INSERT OR IGNORE INTO ratings(user_id, rating, matches)
+        VALUES(?, ?, 0)
+        """, (user_id, initial))
+    g.db.execute("""
+        INSERT OR IGNORE INTO season_ratings(season_id, user_id, rating,
+        matches)
+        SELECT ?, user_id, rating, 0 FROM ratings WHERE user_id = ?
+        """, (season_id, user_id))
+    g.db.execute("""
+        UPDATE ratings SET rating = rating + ?, matches = matches + ?
+        WHERE user_id = ?
+        """, (delta, played, user_id))
+    g.db.execute("""
+        UPDATE season_ratings SET rating = rating + ?, matches = matches + ?
+        WHERE season_id = ?
+        AND user_id = ?
+        """, (delta, played, season_id, user_id))
+
+
+def update(match_id, before, after):
+    """Move the players' ratings from outcome `before` to `after`.
+
+    Outcomes are standings.get_outcome() values, None while the match is
+    incomplete. Does not commit.
+    """
+    row = g.db.execute('SELECT rating_delta FROM matches WHERE id = ?',
+            (match_id,)).fetchone()
+    if before and row and row[0] is not None:
+        season_id, division, ((alpha, _), (beta, _)) = before
+        _adjust(season_id, alpha, -row[0], -1)
+        _adjust(season_id, beta, row[0], -1)
+
+    delta = None
+    if after:
+        season_id, division, ((alpha, result), (beta, _)) = after
+        value = {'win': 1.0, 'draw': 0.5, 'loss': 0.0}[result]
+        delta = current_app.config['RATING_K'] * (value - expected(
+            get_rating(alpha), get_rating(beta)))
+        _adjust(season_id, alpha, delta, 1)
+        _adjust(season_id, beta, -delta, 1)
+    g.db.execute('UPDATE matches SET rating_delta = ? WHERE id = ?',
+            (delta, match_id))
+
+
+def replay_python(matches, initial, k):
+    # matches are (season_id, round, alpha, beta, score) in rating order,
+    # each rated from the ratings after the ones before it, like update().
+    # Returns (deltas, ratings, season ratings).
+    ratings = {}
+    played = {}
+    seasons = {}
+    deltas = []
+    for season_id, round, alpha, beta, value in matches:
+        rating, other = ratings.get(alpha, initial), ratings.get(beta, initial)
+        delta = k * (value - expected(rating, other))
+        deltas.append(delta)
+        ratings[alpha] = rating + delta
+        ratings[beta] = other - delta
+        for user_id in (alpha, beta):
+            played[user_id] = played.get(user_id, 0) + 1
+            count = seasons.get((season_id, user_id), (None, 0))[1]
+            seasons[(season_id, user_id)] = (ratings[user_id], count + 1)
+    ratings = dict((user_id, (rating, played[user_id]))
+            for user_id, rating in ratings.iteritems())
+    return deltas, ratings, seasons
+
+
+def get_batches(matches):
+    # [start, end) runs of matches without a player in common and within
+    # one season. Their matches don't see each other's rating changes, so
+    # rating a run at once equals rating its matches one by one. A round
+    # robin round is one run per season.
+    bounds = [0]
+    players = set()
+    season_id = None
+    for i, (season, round, alpha, beta, value) in enumerate(matches):
+        if season != season_id or alpha in players or beta in players:
+            if i:
+                bounds.append(i)
+            players = set()
+            season_id = season
+        players.add(alpha)
+        players.add(beta)
+    bounds.append(len(matches))
+    return zip(bounds[:-1], bounds[1:])
+
+
+def replay_numpy(matches, initial, k):
+    # same as replay_python, one vectorized update per batch
+    if not matches:
+        return [], {}, {}
+    season_ids, rounds, alpha, beta, values = zip(*matches)
+    users, players = numpy.unique(alpha + beta, return_inverse=True)
+    alpha, beta = players[:len(matches)], players[len(matches):]
+    values = numpy.array(values)
+    season_ids = numpy.array(season_ids)
+    season_ends = set((numpy.flatnonzero(season_ids[1:] != season_ids[:-1])
+        + 1).tolist())
+    season_ends.add(len(matches))
+
+    ratings = numpy.empty(len(users))
+    ratings.fill(initial)
+    deltas = numpy.empty(len(matches))
+    seasons = {}
+    season_start = 0
+    for start, end in get_batches(matches):
+        a, b = alpha[start:end], beta[start:end]
+        delta = k * (values[start:end] - 1 / (1 + 10 ** (
+            (ratings[b] - ratings[a]) / 400.0)))
+        deltas[start:end] = delta
+        ratings[a] += delta
+        ratings[b] -= delta
+        if end in season_ends:
+            counts = numpy.bincount(numpy.concatenate((
+                alpha[season_start:end], beta[season_start:end])),
+                minlength=len(users))
+            played = numpy.flatnonzero(counts)
+            season_id = int(season_ids[start])
+            seasons.update(((season_id, user_id), (rating, count))
+                    for user_id, rating, count in zip(
+                        users[played].tolist(), ratings[played].tolist(),
+                        counts[played].tolist()))
+            season_start = end
+
+    played = numpy.bincount(players, minlength=len(users))
+    ratings = dict((user_id, (rating, count)) for user_id, rating, count
+            in zip(users.tolist(), ratings.tolist(), played.tolist()))
+    return deltas.tolist(), ratings, seasons
+
+
+def rebuild():
+    """Recompute every rating from the full match history, and commit."""
+    config = current_app.config
+    rows = g.db.execute(HISTORY_QUERY).fetchall()
+    matches = [(season_id, round, alpha, beta, score(alpha_games,
+        beta_games)) for match_id, season_id, round, alpha, beta,
+        alpha_games, beta_games in rows]
+    replay = replay_numpy if numpy is not None else replay_python
+    deltas, ratings, seasons = replay(matches, config['RATING_INITIAL'],
+            config['RATING_K'])
+
+    g.db.execute('DELETE FROM ratings')
+    g.db.execute('DELETE FROM season_ratings')
+    g.db.execute('UPDATE matches SET rating_delta = NULL')
+    g.db.executemany("""
+        INSERT INTO ratings(user_id, rating, matches) VALUES(?, ?, ?)
+        """, ((user_id, rating, played)
+            for user_id, (rating, played) in ratings.iteritems()))
+    g.db.executemany("""
+        INSERT INTO season_ratings(season_id, user_id, rating, matches)
+        VALUES(?, ?, ?, ?)
+        """, ((season_id, user_id, rating, played)
+            for (season_id, user_id), (rating, played)
+            in seasons.iteritems()))
+    g.db.executemany('UPDATE matches SET rating_delta = ? WHERE id = ?',
+            ((delta, row[0]) for delta, row in zip(deltas, rows)))
+    g.db.commit()
+    return len(rows)
+
+
+def get_user_ratings(user_id):
+    # (rating, matches) and the per season rows, newest season first
+    from wsw import query_db
+    query = 'SELECT rating, matches FROM ratings WHERE user_id = ?'
+    overall = query_db(query, (user_id,), one=True)
+    return overall, query_db(SEASON_RATINGS_QUERY, (user_id,))
@@ -0,0 +1,65 @@
+import threading
+from collections import namedtuple
+
+
+# Column names -> record class, shared by every statement with that shape
+_classes = {}
+_lock = threading.Lock()
+
+
+def _create_record_class(names):
+    base = namedtuple('Record', names, rename=True)
+    index = {}
+    for i, name in enumerate(names):
+        index.setdefault(name, i)
+
+    class Record(base):
+        """Immutable row readable by attribute, column name or position."""
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, basestring):
+                key = index[key]
+            return tuple.__getitem__(self, key)
+
+        def get(self, key, default=None):
+            i = index.get(key)
+            if i is None:
+                return default
+            return tuple.__getitem__(self, i)
+
+        def keys(self):
+            return list(names)
+
+        def __contains__(self, key):
+            return key in index
+
+    return Record
+
+
+def get_record_class(description):
+    names = tuple(column[0] for column in description)
+    cls = _classes.get(names)
+    if cls is None:
+        with _lock:
+            cls = _classes.get(names)
+            if cls is None:
+                cls = _classes[names] = _create_record_class(names)
+    return cls
+
+
+def make_records(cursor, rows):
+    cls = get_record_class(cursor.description)
+    new = tuple.__new__
+    return [new(cls, row) for row in rows]
+
+
+def iter_records(cursor, size=500):
+    cls = get_record_class(cursor.description)
+    new = tuple.__new__
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        for row in rows:
+            yield new(cls, row)
@@ -0,0 +1,82 @@
+import sqlite3
+
+from flask import g
+
+from wsw import cache
+
+
+# Usernames starting with the term, a prefix range on
+# users_username_nocase_idx
+RANGE_QUERY = """
+SELECT id, username FROM users
+WHERE username >= ? COLLATE NOCASE
+AND username < ? COLLATE NOCASE
+%s
+ORDER BY username COLLATE NOCASE ASC
+LIMIT ?
+"""
+
+# Usernames with a later word starting with the term. users_fts is only
+# created where sqlite has FTS5, see migration 7.
+FTS_QUERY = """
+SELECT users.id, users.username FROM users_fts
+JOIN users ON users.id = users_fts.rowid
+WHERE users_fts MATCH ?
+%s
+LIMIT ?
+"""
+
+NOT_SIGNED_UP = """
+AND users.id NOT IN (SELECT user_id FROM signups WHERE season_id = ?)
+"""
+
+
+def has_user_index():
+    def load():
+        query = """
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?
+        """
+        return g.db.execute(query, ('users_fts',)).fetchone() is not None
+    return cache.reference.get('users_fts', load)
+
+
+def prefix_range(term):
+    # NOCASE compares ASCII letters lower-cased, every username starting
+    # with `term` sorts in [low, high)
+    low = term.lower()
+    return low, low[:-1] + unichr(ord(low[-1]) + 1)
+
+
+def search_users(term, limit=10, not_in_season=None):
+    """Users whose name, or a word of it, starts with `term`.
+
+    Names starting with `term` come first, in order. `not_in_season` leaves
+    out the players signed up for that season.
+    """
+    term = term.strip()
+    if not term:
+        return []
+    extra = ''
+    args = []
+    if not_in_season is not None:
+        extra = NOT_SIGNED_UP
+        args = [not_in_season]
+
+    cur = g.db.execute(RANGE_QUERY % extra, list(prefix_range(term)) + args
+            + [limit])
+    users = cur.fetchall()
+    if len(users) == limit or not has_user_index():
+        return users
+
+    match = '"%s"*' % term.replace('"', '""')
+    found = set(user[0] for user in users)
+    try:
+        cur = g.db.execute(FTS_QUERY % extra, [match] + args + [limit * 2])
+    except sqlite3.OperationalError:
+        # e.g. a term made only of separators
+        return users
+    for user in cur:
+        if user[0] not in found and len(users) < limit:
+            found.add(user[0])
+            users.append(user)
+    return users
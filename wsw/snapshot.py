@@ -0,0 +1,187 @@
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+
+def read_only(view):
+    """Marks a view whose query_db() calls may read from the snapshot."""
+    view.read_only = True
+    return view
+
+
+def copy_database(source):
+    # In-memory copy of `source`. Python 2's sqlite3 has no backup API, so
+    # attach the file and copy table by table inside one read transaction.
+    mem = sqlite3.connect(':memory:', check_same_thread=False,
+            isolation_level=None)
+    mem.execute('ATTACH DATABASE ? AS disk', (source,))
+    mem.execute('BEGIN')
+    query = """
+    SELECT type, name, sql FROM disk.sqlite_master
+    WHERE sql IS NOT NULL
+    AND name NOT LIKE 'sqlite_%'
+    AND type IN ('table', 'index')
+    ORDER BY type = 'index'
+    """
+    entries = mem.execute(query).fetchall()
+    # virtual tables and their shadow tables are left out, query them on
+    # the primary
+    virtual = [name for type, name, sql in entries
+            if sql.upper().startswith('CREATE VIRTUAL')]
+    for type, name, sql in entries:
+        if any(name == v or name.startswith(v + '_') for v in virtual):
+            continue
+        mem.execute(sql)
+        if type == 'table':
+            mem.execute('INSERT INTO main."%s" SELECT * FROM disk."%s"' % (
+                name, name))
+    version = mem.execute('PRAGMA disk.user_version').fetchone()[0]
+    mem.execute('COMMIT')
+    mem.execute('DETACH DATABASE disk')
+    mem.execute('PRAGMA user_version = %i' % version)
+    return mem
+
+
+class Snapshot(object):
+    """In-memory copies of the database for read-only queries.
+
+    Every thread reads from its own copy, so reads never wait for each
+    other. Commits seen by `mark_stale` or by `PRAGMA data_version` make
+    the copies stale. A thread reloads its stale copy on its next read, at
+    most once every `refresh_interval` seconds; until then its reads fall
+    back to the primary, so nothing older than the last known commit is
+    ever served.
+    """
+
+    def __init__(self, database=None, enabled=False, refresh_interval=2,
+            check_interval=1):
+        self.configure(database, enabled, refresh_interval, check_interval)
+
+    def configure(self, database, enabled=False, refresh_interval=2,
+            check_interval=1):
+        self.database = database
+        self.enabled = enabled and database not in (None, ':memory:')
+        self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+        self.reset()
+
+    def reset(self):
+        if getattr(self, 'pid', None) == os.getpid():
+            self.close()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.check_lock = threading.Lock()
+        # the copies of the threads, a thread drops its own once it
+        # notices a reset
+        self.local = threading.local()
+        self.watcher = None
+        self.data_version = None
+        # bumped on every commit seen, a copy made before is stale
+        self.changes = 0
+        self.refreshed = 0
+        self.checked = 0
+        self.refreshes = 0
+        self.refresh_time = 0.0
+        self.errors = 0
+        self.hits = 0
+        self.fallbacks = 0
+
+    def close(self):
+        with self.lock:
+            if self.watcher is not None:
+                self.watcher.close()
+            self.watcher = None
+            self.local = threading.local()
+
+    def mark_stale(self):
+        with self.lock:
+            self.changes += 1
+
+    def check(self):
+        # notices commits made by other connections and processes
+        now = time.time()
+        if now - self.checked < self.check_interval:
+            return
+        if not self.check_lock.acquire(False):
+            return
+        try:
+            self.checked = now
+            if self.watcher is None:
+                self.watcher = sqlite3.connect(self.database,
+                        check_same_thread=False)
+            cur = self.watcher.execute('PRAGMA data_version')
+            version = cur.fetchone()[0]
+            if version != self.data_version:
+                self.data_version = version
+                self.mark_stale()
+        finally:
+            self.check_lock.release()
+
+    def refresh(self, local):
+        # reloads this thread's copy, None when it failed or is not due
+        start = time.time()
+        if start - getattr(local, 'refreshed', 0) < self.refresh_interval:
+            return None
+        local.refreshed = start
+        changes = self.changes
+        old, local.conn = getattr(local, 'conn', None), None
+        if old is not None:
+            old.close()
+        try:
+            conn = copy_database(self.database)
+        except sqlite3.Error:
+            # reads use the primary until the next attempt
+            current_app.logger.exception("Snapshot refresh")
+            with self.lock:
+                self.errors += 1
+            return None
+        local.conn = conn
+        local.changes = changes
+        with self.lock:
+            self.refreshed = time.time()
+            self.refreshes += 1
+            self.refresh_time = self.refreshed - start
+        return conn
+
+    def get_connection(self):
+        # this thread's copy if it is up to date
+        local = self.local
+        conn = getattr(local, 'conn', None)
+        if conn is None or local.changes != self.changes:
+            conn = self.refresh(local)
+        return conn
+
+    def query(self, query, args=()):
+        # (cursor, rows) from the snapshot, None to use the primary instead
+        if not self.enabled:
+            return None
+        if self.pid != os.getpid():
+            self.reset()
+
+        self.check()
+        conn = self.get_connection()
+        if conn is None:
+            with self.lock:
+                self.fallbacks += 1
+            return None
+
+        cur = conn.execute(query, args)
+        rows = cur.fetchall()
+        with self.lock:
+            self.hits += 1
+        return cur, rows
+
+    def stats(self):
+        return {
+                'enabled': self.enabled,
+                'refreshes': self.refreshes,
+                'refresh_time': self.refresh_time,
+                'errors': self.errors,
+                'age': time.time() - self.refreshed if self.refreshed
+                    else None,
+                'hits': self.hits,
+                'fallbacks': self.fallbacks,
+                }
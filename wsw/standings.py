@@ -0,0 +1,189 @@
+import sqlite3
+from itertools import groupby
+
+from flask import g, current_app
+
+from wsw import ratings
+
+
+# Completed games per match. A match counts towards the standings once
+# every one of its games has both scores.
+TALLY_QUERY = """
+SELECT matches.id, matches.season_id, matches.division,
+alpha.user_id, beta.user_id,
+SUM(results.alpha_score > results.beta_score),
+SUM(results.beta_score > results.alpha_score)
+FROM matches
+JOIN match_players AS alpha
+ON alpha.match_id = matches.id AND alpha.alpha = 1
+JOIN match_players AS beta
+ON beta.match_id = matches.id AND beta.alpha = 0
+JOIN results ON results.match_id = matches.id
+WHERE %s
+GROUP BY matches.id
+HAVING SUM(results.alpha_score IS NULL OR results.beta_score IS NULL) = 0
+"""
+
+
+def get_points():
+    config = current_app.config
+    return {
+            'win': config['POINTS_WIN'],
+            'draw': config['POINTS_DRAW'],
+            'loss': config['POINTS_LOSS'],
+            }
+
+
+def get_outcome(match_id):
+    # (season_id, division, ((alpha_id, result), (beta_id, result))) or None
+    # while the match is incomplete
+    query = TALLY_QUERY % 'matches.id = ?'
+    row = g.db.execute(query, (match_id,)).fetchone()
+    if not row:
+        return None
+    return _outcome(row)
+
+
+def _outcome(row):
+    match_id, season_id, division, alpha, beta, alpha_games, beta_games = row
+    if alpha_games > beta_games:
+        results = ((alpha, 'win'), (beta, 'loss'))
+    elif alpha_games < beta_games:
+        results = ((alpha, 'loss'), (beta, 'win'))
+    else:
+        results = ((alpha, 'draw'), (beta, 'draw'))
+    return (season_id, division, results)
+
+
+def _apply(outcome, sign):
+    season_id, division, results = outcome
+    points = get_points()
+    query = """
+    UPDATE signups SET points = points + ?, wins = wins + ?,
+    draws = draws + ?, losses = losses + ?
+    WHERE season_id = ?
+    AND user_id = ?
+    """
+    values = [(sign * points[result], sign * (result == 'win'),
+        sign * (result == 'draw'), sign * (result == 'loss'),
+        season_id, user_id) for user_id, result in results]
+    g.db.executemany(query, values)
+
+
+def rank(season_id, division=None):
+    query = """
+    SELECT division, user_id FROM signups
+    WHERE season_id = ?
+    AND division > 0
+    """
+    values = (season_id,)
+    if division is not None:
+        query += 'AND division = ?'
+        values = (season_id, division)
+    query += """
+    ORDER BY division ASC, points DESC, wins DESC, losses ASC, user_id ASC
+    """
+    cur = g.db.execute(query, values)
+
+    positions = []
+    for number, players in groupby(cur.fetchall(), lambda row: row[0]):
+        for position, (number, user_id) in enumerate(players):
+            positions.append((position + 1, season_id, user_id))
+
+    query = """
+    UPDATE signups SET position = ?
+    WHERE season_id = ?
+    AND user_id = ?
+    """
+    g.db.executemany(query, positions)
+
+
+def apply_result(match_id, game_id, map_id, alpha_score, beta_score):
+    """Store one game's score and update the two players' signups rows.
+
+    Does not commit. Returns the (season_id, division) whose ranking is now
+    stale, None if the standings did not change and False if there is no
+    such game.
+    """
+    before = get_outcome(match_id)
+
+    query = """
+    UPDATE results SET map_id = ?, alpha_score = ?, beta_score = ?
+    WHERE match_id = ?
+    AND game_id = ?
+    """
+    values = (map_id, alpha_score, beta_score, match_id, game_id)
+    cur = g.db.execute(query, values)
+    if not cur.rowcount:
+        return False
+
+    after = get_outcome(match_id)
+    if before == after:
+        return None
+
+    if before:
+        _apply(before, -1)
+    if after:
+        _apply(after, 1)
+    ratings.update(match_id, before, after)
+
+    query = 'UPDATE matches SET played = ? WHERE id = ?'
+    g.db.execute(query, (after is not None, match_id))
+
+    season_id, division = (after or before)[:2]
+    return (season_id, division)
+
+
+def record_result(match_id, game_id, map_id, alpha_score, beta_score):
+    try:
+        stale = apply_result(match_id, game_id, map_id, alpha_score,
+                beta_score)
+        if stale is False:
+            g.db.rollback()
+            return False
+        if stale:
+            rank(*stale)
+    except sqlite3.Error:
+        g.db.rollback()
+        return False
+
+    g.db.commit()
+    return True
+
+
+def rebuild(season_id):
+    # Recompute every signup's stats of a season from its results
+    tally = {}
+    played = []
+    cur = g.db.execute(TALLY_QUERY % 'matches.season_id = ?', (season_id,))
+    points = get_points()
+    for row in cur.fetchall():
+        played.append((row[0],))
+        for user_id, result in _outcome(row)[2]:
+            stats = tally.setdefault(user_id, [0, 0, 0, 0])
+            stats[0] += points[result]
+            stats[1] += result == 'win'
+            stats[2] += result == 'draw'
+            stats[3] += result == 'loss'
+
+    query = """
+    UPDATE signups SET position = NULL, points = 0, wins = 0, draws = 0,
+    losses = 0
+    WHERE season_id = ?
+    """
+    g.db.execute(query, (season_id,))
+
+    query = """
+    UPDATE signups SET points = ?, wins = ?, draws = ?, losses = ?
+    WHERE season_id = ?
+    AND user_id = ?
+    """
+    g.db.executemany(query, (stats + [season_id, user_id]
+        for user_id, stats in tally.iteritems()))
+
+    g.db.execute('UPDATE matches SET played = 0 WHERE season_id = ?',
+            (season_id,))
+    g.db.executemany('UPDATE matches SET played = 1 WHERE id = ?', played)
+
+    rank(season_id)
+    g.db.commit()
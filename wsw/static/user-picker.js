@@ -0,0 +1,21 @@
+// Suggests usernames from the admin user search as the admin types, for
+// forms marked class="user-picker" data-user-search="<search url>"
+$(function () {
+  $('form.user-picker').each(function () {
+    var url = $(this).data('user-search');
+    var pending = null;
+    $(this).find('input[name=username]').attr('autocomplete', 'off').typeahead({
+      items: 10,
+      source: function (query, process) {
+        clearTimeout(pending);
+        pending = setTimeout(function () {
+          $.getJSON(url, {q: query, limit: 10}, function (users) {
+            process($.map(users, function (user) {
+              return user.username;
+            }));
+          });
+        }, 150);
+      }
+    });
+  });
+});
@@ -0,0 +1,186 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+
+# Literals and IN lists are folded so one query shape is one entry
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class Statement(object):
+    __slots__ = ('sql', 'seconds', 'rows')
+
+    def __init__(self, sql, seconds, rows):
+        self.sql = sql
+        self.seconds = seconds
+        self.rows = rows
+
+
+class TracedCursor(object):
+    """Counts fetched rows and fetch time against its statement."""
+
+    def __init__(self, cursor, statement):
+        self._cursor = cursor
+        self._statement = statement
+
+    def _fetched(self, start, rows):
+        self._statement.seconds += time.time() - start
+        self._statement.rows += rows
+
+    def fetchone(self):
+        start = time.time()
+        row = self._cursor.fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, *args):
+        start = time.time()
+        rows = self._cursor.fetchmany(*args)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.time()
+        rows = self._cursor.fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                break
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class Trace(object):
+    """Statements run on one connection during one request."""
+
+    def __init__(self):
+        self.statements = []
+
+    def add(self, sql, seconds, cursor):
+        rows = cursor.rowcount if cursor.rowcount > 0 else 0
+        statement = Statement(normalize(sql), seconds, rows)
+        self.statements.append(statement)
+        return TracedCursor(cursor, statement)
+
+    def summary(self, repeat):
+        shapes = {}
+        for statement in self.statements:
+            shapes[statement.sql] = shapes.get(statement.sql, 0) + 1
+        return {
+                'count': len(self.statements),
+                'seconds': sum(s.seconds for s in self.statements),
+                'rows': sum(s.rows for s in self.statements),
+                'repeated': sorted(((count, sql)
+                    for sql, count in shapes.items() if count >= repeat),
+                    reverse=True),
+                }
+
+
+class TracingConnection(sqlite3.Connection):
+    """Connection that reports to `trace` while one is attached."""
+
+    trace = None
+
+    def execute(self, sql, *args):
+        trace = self.trace
+        if trace is None:
+            return sqlite3.Connection.execute(self, sql, *args)
+        start = time.time()
+        cursor = sqlite3.Connection.execute(self, sql, *args)
+        return trace.add(sql, time.time() - start, cursor)
+
+    def executemany(self, sql, *args):
+        trace = self.trace
+        if trace is None:
+            return sqlite3.Connection.executemany(self, sql, *args)
+        start = time.time()
+        cursor = sqlite3.Connection.executemany(self, sql, *args)
+        return trace.add(sql, time.time() - start, cursor)
+
+
+class Recorder(object):
+    """Totals per statement shape across requests, plus recent N+1s."""
+
+    def __init__(self, repeat=5, keep=20):
+        self.lock = threading.Lock()
+        self.repeat = repeat
+        self.shapes = {}
+        self.requests = 0
+        self.repeated = deque(maxlen=keep)
+
+    def record(self, endpoint, trace):
+        summary = trace.summary(self.repeat)
+        with self.lock:
+            self.requests += 1
+            for statement in trace.statements:
+                entry = self.shapes.setdefault(statement.sql, [0, 0.0, 0])
+                entry[0] += 1
+                entry[1] += statement.seconds
+                entry[2] += statement.rows
+            for count, sql in summary['repeated']:
+                self.repeated.appendleft((endpoint, count, sql))
+        return summary
+
+    def stats(self, limit=10):
+        with self.lock:
+            slowest = sorted(self.shapes.items(), key=lambda i: -i[1][1])
+            return {
+                    'requests': self.requests,
+                    'shapes': [{
+                        'sql': sql,
+                        'count': count,
+                        'seconds': seconds,
+                        'rows': rows,
+                        } for sql, (count, seconds, rows) in slowest[:limit]],
+                    'repeated': list(self.repeated),
+                    }
+
+    def reset(self):
+        with self.lock:
+            self.shapes.clear()
+            self.requests = 0
+            self.repeated.clear()
+
+
+recorder = Recorder()
+
+
+def begin(db):
+    # no-op unless the pool hands out tracing connections
+    if isinstance(db, TracingConnection):
+        db.trace = Trace()
+        return db.trace
+
+
+def end(db):
+    if isinstance(db, TracingConnection):
+        db.trace = None
+
+
+def add_headers(response, summary):
+    response.headers['X-SQL-Count'] = str(summary['count'])
+    response.headers['X-SQL-Time'] = '%.2f' % (summary['seconds'] * 1000)
+    response.headers['X-SQL-Rows'] = str(summary['rows'])
+    if summary['repeated']:
+        response.headers['X-SQL-Repeated'] = '; '.join(
+                '%ix %s' % (count, sql[:80])
+                for count, sql in summary['repeated'][:3])
+    return response
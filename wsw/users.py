@@ -1,7 +1,10 @@
-from flask.ext.login import (UserMixin, AnonymousUser)
+# Implement the Flask-Login user interface directly, its UserMixin and
+# AnonymousUser have no __slots__ and would give every instance a __dict__
 
 
-class User(UserMixin):
+class User(object):
+    __slots__ = ('name', 'id', 'admin', 'active')
+
     def __init__(self, name, id, admin=False, active=True):
         self.name = name
         self.id = id
@@ -14,10 +17,44 @@ class User(UserMixin):
     def is_admin(self):
         return self.admin
 
+    def is_authenticated(self):
+        return True
+
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return unicode(self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+
+class Anonymous(object):
+    __slots__ = ()
 
-class Anonymous(AnonymousUser):
     name = u"Anonymous"
     admin = False
 
     def is_admin(self):
         return False
+
+    def is_active(self):
+        return False
+
+    def is_authenticated(self):
+        return False
+
+    def is_anonymous(self):
+        return True
+
+    def get_id(self):
+        return None
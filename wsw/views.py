@@ -1,10 +1,22 @@
-from flask import (render_template, request, g, flash, redirect, url_for)
+import time
+
+from flask import (render_template, request, g, flash, redirect, url_for,
+        abort)
 from flask.ext.login import (login_user, logout_user, login_required,
         current_user)
-from wsw import (app, bcrypt, query_db, register_user, setup, get_divisions)
+from wsw import (app, cache, hasher, query_db, ratings, register_user,
+        setup, get_divisions)
 from wsw.forms import LoginForm, RegistrationForm
 from wsw.users import User
 from wsw.league import Season
+from wsw.pages import cached_page, fragment
+from wsw.snapshot import read_only
+
+
+LOGIN_QUERY = """
+SELECT id, username, password, is_admin, is_active FROM users
+WHERE username = ? COLLATE NOCASE
+"""
 
 
 # Helper functions
@@ -27,6 +39,32 @@ def get_signups(season_id):
     return query_db(query, [season_id])
 
 
+def rehash_password(user_id, password):
+    # the configured cost changed since this hash was made
+    pw_hash = hasher.generate(password)
+    start = time.time()
+    query = 'UPDATE users SET password = ? WHERE id = ?'
+    g.db.execute(query, (pw_hash, user_id))
+    g.db.commit()
+    hasher.timings.record('db', time.time() - start)
+
+
+# Per-user fragments of cached pages
+
+@fragment('navbar')
+def navbar(active_page=None):
+    return render_template('fragments/navbar.html', active_page=active_page)
+
+
+@fragment('signup')
+def signup_button():
+    signedup = False
+    if current_user.is_authenticated():
+        season = Season(Season.get_current_season_id())
+        signedup = season.is_signed_up(current_user.get_id())
+    return render_template('fragments/signup.html', signedup=signedup)
+
+
 # Error handlers
 
 @app.errorhandler(401)
@@ -49,6 +87,8 @@ def reset():
 
 
 @app.route('/')
+@read_only
+@cached_page
 def index():
     return render_template('index.html')
 
@@ -65,13 +105,23 @@ def register():
 
 
 @app.route('/users/')
+@read_only
+@cached_page
 def users():
     return render_template('users.html', users=get_users())
 
 
-@app.route('/user/<id>')
+@app.route('/user/<int:id>')
+@read_only
+@cached_page
 def user(id):
-    return render_template('users.html', users=get_users())
+    query = 'SELECT id, username, is_admin FROM users WHERE id = ?'
+    user = query_db(query, (id,), one=True)
+    if user is None:
+        abort(404)
+    rating, seasons = ratings.get_user_ratings(id)
+    return render_template('profile.html', user=user, rating=rating,
+            seasons=seasons)
 
 
 @app.route('/login', methods=['POST', 'GET'])
@@ -79,14 +129,17 @@ def login():
     form = LoginForm(request.form, prefix='login_')
     if request.method == 'POST':
         if form.validate_on_submit():
-            query = """
-            SELECT id, username, password, is_admin, is_active FROM users
-            WHERE username LIKE ?
-            """
             values = [form.username.data]
-            result = query_db(query, values, one=True)
-            if result and bcrypt.check_password_hash(result['password'],
-            form.password.data):
+            start = time.time()
+            result = query_db(LOGIN_QUERY, values, one=True)
+            hasher.timings.record('db', time.time() - start)
+            if result and hasher.check(result['password'],
+                    form.password.data):
+                if hasher.needs_rehash(result['password']):
+                    rehash_password(result['id'], form.password.data)
+                # later requests load the user through the cache, start
+                # them from the row just read
+                cache.users.invalidate(result['id'])
                 user = User(result['username'], result['id'],
                         result['is_admin'], result['is_active'])
                 if login_user(user, form.remember.data):
@@ -141,6 +194,8 @@ def usnignup():
 
 
 @app.route("/matches")
+@read_only
+@cached_page
 def matches():
     return render_template("matches.html")
 
@@ -150,15 +205,18 @@ def my_matches():
 
 
 @app.route("/signups/")
+@read_only
+@cached_page
 def signups():
     season_id = Season.get_current_season_id()
-    user_id = current_user.get_id()
-    signups = get_signups(season_id)
-    query = """
-    SELECT COUNT(*) as count FROM signups
-    WHERE season_id = ?
-    AND user_id = ?
-    """
-    signedup = query_db(query, [season_id, user_id], True)['count']
-    return render_template('signups.html', signups=signups, signedup=signedup,
+    return render_template('signups.html', signups=get_signups(season_id),
             divisions=get_divisions(season_id))
+
+
+@app.route("/standings/")
+@read_only
+@cached_page
+def standings():
+    season = Season(Season.get_current_season_id())
+    return render_template('standings.html', season=season,
+            divisions=season.get_standings())